@@ -0,0 +1,140 @@
+"""
+Vectorized 2048 for many boards at once.
+
+Boards are packed the same way as bitboard.py (one uint64 per board, 4-bit log2
+tiles) and held in a 1-D NumPy array, so a batch of B boards is moved, checked
+and given new tiles with a handful of array operations. Row moves reuse the
+bitboard lookup tables; up/down transpose the whole batch.
+
+Directions are given as indices into bitboard.DIRECTIONS (0 up, 1 down, 2 left, 3 right).
+"""
+import numpy as np
+
+import bitboard
+
+UP, DOWN, LEFT, RIGHT = (bitboard.DIRECTIONS.index(d) for d in ("up", "down", "left", "right"))
+
+# Row tables stacked so one fancy-index picks left or right per board: TABLE[side, row]
+ROW_TABLE = np.array([bitboard.ROW_LEFT, bitboard.ROW_RIGHT], dtype=np.uint64)
+SCORE_TABLE = np.array([bitboard.ROW_SCORE_LEFT, bitboard.ROW_SCORE_RIGHT], dtype=np.int64)
+
+_ROW_MASK = np.uint64(0xFFFF)
+_CELL_MASK = np.uint64(0xF)
+_ROW_SHIFTS = [np.uint64(s) for s in (0, 16, 32, 48)]
+_CELL_SHIFTS = np.arange(0, 64, 4, dtype=np.uint64)
+
+
+def transpose(boards):
+    """Swap rows and columns of every board in the batch"""
+    a1 = boards & np.uint64(0xF0F00F0FF0F00F0F)
+    a2 = boards & np.uint64(0x0000F0F00000F0F0)
+    a3 = boards & np.uint64(0x0F0F00000F0F0000)
+    a = a1 | (a2 << np.uint64(12)) | (a3 >> np.uint64(12))
+    b1 = a & np.uint64(0xFF00FF0000FF00FF)
+    b2 = a & np.uint64(0x00FF00FF00000000)
+    b3 = a & np.uint64(0x00000000FF00FF00)
+    return b1 | (b2 >> np.uint64(24)) | (b3 << np.uint64(24))
+
+
+def _move_rows(boards, side):
+    new_boards = np.zeros_like(boards)
+    scores = np.zeros(boards.shape, dtype=np.int64)
+    for shift in _ROW_SHIFTS:
+        rows = ((boards >> shift) & _ROW_MASK).astype(np.intp)
+        new_boards |= ROW_TABLE[side, rows] << shift
+        scores += SCORE_TABLE[side, rows]
+    return new_boards, scores
+
+
+def move(boards, directions):
+    """
+    Moves every board in its own direction (an int or an array of direction indices).
+    Returns (new_boards, score_increases, moved) where moved is False for invalid moves.
+    """
+    directions = np.broadcast_to(np.asarray(directions), boards.shape)
+    vertical = directions <= DOWN
+    side = ((directions == DOWN) | (directions == RIGHT)).astype(np.intp)
+
+    rows = np.where(vertical, transpose(boards), boards)
+    new_rows, scores = _move_rows(rows, side)
+    new_boards = np.where(vertical, transpose(new_rows), new_rows)
+    return new_boards, scores, new_boards != boards
+
+
+def valid_moves(boards):
+    """(B, 4) bool mask of the valid directions for each board"""
+    mask = np.empty(boards.shape + (4,), dtype=bool)
+    for direction in range(4):
+        mask[:, direction] = move(boards, direction)[2]
+    return mask
+
+
+def cells(boards):
+    """(B, 16) array of log2 tile exponents, row-major"""
+    return ((boards[:, None] >> _CELL_SHIFTS) & _CELL_MASK).astype(np.uint8)
+
+
+def spawn_tiles(boards, rng, where=None):
+    """
+    Adds a tile to one uniformly chosen empty cell of each board (only where the mask is True),
+    a 2 with probability 0.9 and a 4 otherwise, like CoreGame2048.add_new_tile. Full boards are left alone.
+    """
+    empty = cells(boards) == 0
+    if where is not None:
+        empty &= where[:, None]
+    has_empty = empty.any(axis=1)
+
+    # argmax of random keys over the empty cells is a uniform choice among them
+    keys = np.where(empty, rng.random(empty.shape), -1.0)
+    index = keys.argmax(axis=1).astype(np.uint64)
+    exponent = np.where(rng.random(boards.shape) < 0.9, 1, 2).astype(np.uint64)
+    tiles = np.where(has_empty, exponent << (index * np.uint64(4)), np.uint64(0))
+    return boards | tiles
+
+
+def from_grids(grids):
+    """Packs a (B, 4, 4) array of tile values into boards"""
+    grids = np.asarray(grids).reshape(-1, 16)
+    exponents = np.where(grids > 0, np.log2(np.maximum(grids, 1)), 0).astype(np.uint64)
+    return np.bitwise_or.reduce(exponents << _CELL_SHIFTS, axis=1)
+
+
+def to_grids(boards):
+    """Unpacks boards into a (B, 4, 4) array of tile values"""
+    exponents = cells(boards).astype(np.int64)
+    return np.where(exponents > 0, 1 << exponents, 0).reshape(-1, 4, 4)
+
+
+class BatchGame2048:
+    """B independent games moved in lockstep"""
+    def __init__(self, batch_size, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.boards = np.zeros(batch_size, dtype=np.uint64)
+        self.scores = np.zeros(batch_size, dtype=np.int64)
+        self.boards = spawn_tiles(self.boards, self.rng)
+        self.boards = spawn_tiles(self.boards, self.rng)
+
+    def move(self, directions):
+        """Moves every board, scores and spawns a tile on those that changed. Returns the moved mask."""
+        new_boards, scores, moved = move(self.boards, directions)
+        self.scores += np.where(moved, scores, 0)
+        self.boards = spawn_tiles(new_boards, self.rng, where=moved)
+        return moved
+
+    def get_possible_moves(self):
+        """(B, 4) bool mask of valid directions"""
+        return valid_moves(self.boards)
+
+    def is_game_over(self):
+        return ~self.get_possible_moves().any(axis=1)
+
+    def random_moves(self, valid=None):
+        """A uniformly random valid direction per board (UP for boards with no valid move)"""
+        if valid is None:
+            valid = self.get_possible_moves()
+        keys = np.where(valid, self.rng.random(valid.shape), -1.0)
+        return keys.argmax(axis=1)
+
+    @property
+    def grids(self):
+        return to_grids(self.boards)
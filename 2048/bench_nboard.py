@@ -0,0 +1,90 @@
+"""
+Speed of the nboard.py engines against the list implementation (CoreGame2048).
+
+Positions come from random games of each size. Every position is moved in all
+four directions by both implementations, which must agree on the new board and
+the score, and the mean time per move is printed in microseconds:
+
+    python bench_nboard.py --sizes 3 5 6 8
+"""
+import argparse
+import random
+import time
+
+import nboard
+from game import CoreGame2048
+
+
+def positions(grid_size, count, seed):
+    """Grids of random games, played until count positions are collected"""
+    rng = random.Random(seed)
+    grids = []
+    while len(grids) < count:
+        game = CoreGame2048(grid_size, seed=rng.getrandbits(64))
+        while len(grids) < count:
+            grids.append([row[:] for row in game.grid])
+            moves = [d for d in nboard.DIRECTIONS if game.is_valid_move(d)]
+            if not moves:
+                break
+            game.move(rng.choice(moves))
+    return grids
+
+
+def list_move(game, grid, direction):
+    """CoreGame2048.move without the new tile: (new grid, score increase)"""
+    n = game.grid_size
+    new_grid = [row[:] for row in grid]
+    score_increase = 0
+    for i in range(n):
+        if direction in ("left", "right"):
+            new_grid[i], score = game._merge_line(new_grid[i][:], direction)
+        else:
+            column, score = game._merge_line([new_grid[r][i] for r in range(n)], direction)
+            for r in range(n):
+                new_grid[r][i] = column[r]
+        score_increase += score
+    return new_grid, score_increase
+
+
+def bench(grid_size, count, seed, repeat):
+    engine = nboard.get_engine(grid_size)
+    game = CoreGame2048(grid_size)
+    grids = positions(grid_size, count, seed)
+    boards = [engine.from_grid(grid) for grid in grids]
+    for grid, board in zip(grids, boards):
+        for direction in nboard.DIRECTIONS:
+            new_board, score = engine.move(board, direction)
+            if (engine.to_grid(new_board), score) != list_move(game, grid, direction):
+                raise AssertionError(f"{grid_size}x{grid_size} {direction} differs on {grid}")
+
+    moves = count * len(nboard.DIRECTIONS)
+    results = {}
+    for name, run in (("list", lambda: [list_move(game, grid, d) for grid in grids for d in nboard.DIRECTIONS]),
+                      ("engine", lambda: [engine.move(board, d) for board in boards for d in nboard.DIRECTIONS]),
+                      ("possible_moves", lambda: [engine.possible_moves(board) for board in boards])):
+        best = float("inf")
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            run()
+            best = min(best, time.perf_counter() - t0)
+        results[name] = best * 1e6 / (count if name == "possible_moves" else moves)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the nboard.py engines against CoreGame2048")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[3, 5, 6, 7, 8])
+    parser.add_argument("--positions", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement, the fastest is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    print(f"{'size':>4} {'list us/move':>13} {'engine us/move':>15} {'speedup':>8} {'possible_moves us':>18}")
+    for grid_size in args.sizes:
+        r = bench(grid_size, args.positions, args.seed, args.repeat)
+        print(f"{grid_size:>4} {r['list']:>13.1f} {r['engine']:>15.1f} {r['list'] / r['engine']:>7.1f}x "
+              f"{r['possible_moves']:>18.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Packed 4x4 board for 2048.
+
+The whole grid lives in one 64-bit integer: each cell is a 4-bit nibble holding
+log2 of the tile (0 = empty, 1 = 2, 2 = 4, ... 15 = 32768). Cell (row, col) sits
+at nibble 4 * row + col, so row 0 is the lowest 16 bits and col 0 the lowest
+nibble of each row.
+
+Left/right moves are a single table lookup per row. Up/down transpose the
+board, reuse the row tables and transpose back.
+"""
+
+DIRECTIONS = ("up", "down", "left", "right")
+GRID_SIZE = 4
+MAX_EXPONENT = 15  # 32768 is the largest tile a nibble can hold
+
+ROW_MASK = 0xFFFF
+CELL_MASK = 0xF
+
+
+def unpack_row(row):
+    return [(row >> (4 * i)) & CELL_MASK for i in range(GRID_SIZE)]
+
+
+def pack_row(cells):
+    row = 0
+    for i, cell in enumerate(cells):
+        row |= cell << (4 * i)
+    return row
+
+
+def _merge_row_left(cells):
+    """Same merge rule as CoreGame2048._merge_line, on exponents"""
+    new_cells = [0] * GRID_SIZE
+    index = 0
+    prev = None
+    score = 0
+    for num in (x for x in cells if x != 0):
+        if prev is None:
+            prev = num
+        elif prev == num and num < MAX_EXPONENT:
+            new_cells[index] = num + 1
+            score += 1 << (num + 1)
+            index += 1
+            prev = None
+        else:
+            new_cells[index] = prev
+            index += 1
+            prev = num
+    if prev is not None:
+        new_cells[index] = prev
+    return new_cells, score
+
+
+def _build_tables():
+    left, right = [0] * 65536, [0] * 65536
+    score_left, score_right = [0] * 65536, [0] * 65536
+    empty, tiles = [0] * 65536, [0] * 65536
+    for row in range(65536):
+        cells = unpack_row(row)
+        empty[row] = cells.count(0)
+        tiles[row] = sum(1 << c for c in cells if c)
+
+        new_cells, score = _merge_row_left(cells)
+        left[row] = pack_row(new_cells)
+        score_left[row] = score
+
+        new_cells, score = _merge_row_left(cells[::-1])
+        right[row] = pack_row(new_cells[::-1])
+        score_right[row] = score
+    return left, right, score_left, score_right, empty, tiles
+
+
+# Calculating these once at import, ~65k rows each.
+ROW_LEFT, ROW_RIGHT, ROW_SCORE_LEFT, ROW_SCORE_RIGHT, ROW_EMPTY, ROW_TILE_SUM = _build_tables()
+
+
+def transpose(board):
+    """Swap rows and columns of a packed board"""
+    a1 = board & 0xF0F00F0FF0F00F0F
+    a2 = board & 0x0000F0F00000F0F0
+    a3 = board & 0x0F0F00000F0F0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00FF0000FF00FF
+    b2 = a & 0x00FF00FF00000000
+    b3 = a & 0x00000000FF00FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def _move_rows(board, table, score_table):
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = board >> 48
+    new_board = table[r0] | (table[r1] << 16) | (table[r2] << 32) | (table[r3] << 48)
+    return new_board, score_table[r0] + score_table[r1] + score_table[r2] + score_table[r3]
+
+
+def move(board, direction):
+    """Returns (new_board, score_increase). new_board == board if the move is invalid."""
+    if direction == "left":
+        return _move_rows(board, ROW_LEFT, ROW_SCORE_LEFT)
+    if direction == "right":
+        return _move_rows(board, ROW_RIGHT, ROW_SCORE_RIGHT)
+    if direction == "up":
+        new_board, score = _move_rows(transpose(board), ROW_LEFT, ROW_SCORE_LEFT)
+        return transpose(new_board), score
+    if direction == "down":
+        new_board, score = _move_rows(transpose(board), ROW_RIGHT, ROW_SCORE_RIGHT)
+        return transpose(new_board), score
+    raise ValueError(f"Unknown direction: {direction}")
+
+
+def is_valid_move(board, direction):
+    return move(board, direction)[0] != board
+
+
+def possible_moves(board):
+    """Returns list of valid moves, in the same order as CoreGame2048.get_possible_moves"""
+    return [direction for direction in DIRECTIONS if move(board, direction)[0] != board]
+
+
+def empty_cells(board):
+    """Nibble indices (4 * row + col) of the empty cells, in row-major order"""
+    return [i for i in range(16) if not (board >> (4 * i)) & CELL_MASK]
+
+
+def count_empty(board):
+    return (ROW_EMPTY[board & ROW_MASK] + ROW_EMPTY[(board >> 16) & ROW_MASK]
+            + ROW_EMPTY[(board >> 32) & ROW_MASK] + ROW_EMPTY[board >> 48])
+
+
+def set_cell(board, index, exponent):
+    """Returns board with the nibble at index set to exponent"""
+    shift = 4 * index
+    return (board & ~(CELL_MASK << shift)) | (exponent << shift)
+
+
+def max_tile(board):
+    exponent = max((board >> (4 * i)) & CELL_MASK for i in range(16))
+    return 1 << exponent if exponent else 0
+
+
+def tile_sum(board):
+    return (ROW_TILE_SUM[board & ROW_MASK] + ROW_TILE_SUM[(board >> 16) & ROW_MASK]
+            + ROW_TILE_SUM[(board >> 32) & ROW_MASK] + ROW_TILE_SUM[board >> 48])
+
+
+def from_grid(grid):
+    """Packs a list-of-lists grid of tile values (0, 2, 4, ...) into a board"""
+    board = 0
+    for i, value in enumerate(v for row in grid for v in row):
+        if value:
+            exponent = value.bit_length() - 1
+            if value != 1 << exponent or not 0 < exponent <= MAX_EXPONENT:
+                raise ValueError(f"Tile {value} cannot be stored on a packed board")
+            board |= exponent << (4 * i)
+    return board
+
+
+def to_grid(board):
+    """Unpacks a board into a list-of-lists grid of tile values"""
+    grid = []
+    for r in range(GRID_SIZE):
+        row = []
+        for c in range(GRID_SIZE):
+            exponent = (board >> (4 * (GRID_SIZE * r + c))) & CELL_MASK
+            row.append(1 << exponent if exponent else 0)
+        grid.append(row)
+    return grid
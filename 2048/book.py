@@ -0,0 +1,138 @@
+"""
+Opening book for the 2048 AI.
+
+Self-play keeps passing through the same early positions, so the builder plays
+games, counts the 4x4 boards they visit, searches the most common ones deeply
+once and writes the best move and its expectimax value to a file. Records are
+fixed size and sorted by packed board, so the file is memory-mapped and searched
+with a binary search: nothing is parsed at load time.
+
+    header: magic b"2048BOOK", version (u32), record count (u32), search depth (u32)
+    record: board (u64), value (f32), move index into DIRECTIONS (u8), 3 padding bytes
+
+    python book.py --games 2000 --moves 30 --positions 20000 --depth 6 --output opening.book
+"""
+import argparse
+import mmap
+import os
+import random
+import struct
+from collections import Counter
+from functools import lru_cache
+from multiprocessing import Pool
+
+from nboard import DIRECTIONS
+
+MAGIC = b"2048BOOK"
+VERSION = 1
+HEADER = struct.Struct("<8sIII")
+RECORD = struct.Struct("<QfB3x")
+
+
+class OpeningBook:
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.depth = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a 2048 opening book")
+
+    def lookup(self, board):
+        """Returns (move, value) for a packed 4x4 board, or None if it is not in the book"""
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key, value, move = RECORD.unpack_from(self.data, HEADER.size + mid * RECORD.size)
+            if key == board:
+                return DIRECTIONS[move], value
+            if key < board:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, board):
+        return self.lookup(board) is not None
+
+
+@lru_cache(maxsize=None)
+def get_book(path):
+    """One mapping per book file per process"""
+    return OpeningBook(path)
+
+
+def write_book(path, entries, depth):
+    """entries: iterable of (board, move, value). Written sorted by board, through a temporary file."""
+    entries = sorted(entries)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, len(entries), depth))
+        for board, move, value in entries:
+            f.write(RECORD.pack(board, value, DIRECTIONS.index(move)))
+    os.replace(tmp_path, path)
+
+
+def _sample_game(seed, moves, depth):
+    """Boards visited in the first moves of one self-play game"""
+    from game import Game2048AI, PackedGame2048
+
+    random.seed(seed)
+    game = PackedGame2048(seed=seed)
+    ai = Game2048AI(game, max_depth=depth)
+    boards = []
+    for _ in range(moves):
+        boards.append(game.board)
+        best_move, _ = ai.get_best_move()
+        if best_move is None:
+            break
+        game.move(best_move)
+    return boards
+
+
+def _search_position(board, depth):
+    from game import Game2048AI, PackedGame2048
+
+    game = PackedGame2048(seed=0)
+    game.board = board
+    best_move, value = Game2048AI(game, max_depth=depth).get_best_move()
+    return board, best_move, value
+
+
+def build_book(path, games=1000, moves=30, positions=10000, depth=6, sample_depth=2, seed=0, workers=None):
+    """Samples positions from self-play, searches the most common ones and writes the book"""
+    with Pool(processes=workers) as pool:
+        counts = Counter()
+        jobs = [(seed + i, moves, sample_depth) for i in range(games)]
+        for boards in pool.starmap(_sample_game, jobs, chunksize=8):
+            counts.update(boards)
+
+        common = [board for board, _ in counts.most_common(positions)]
+        results = pool.starmap(_search_position, [(board, depth) for board in common], chunksize=8)
+
+    entries = [(board, move, value) for board, move, value in results if move is not None]
+    write_book(path, entries, depth)
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a 2048 opening book from self-play")
+    parser.add_argument("--games", type=int, default=1000, help="self-play games to sample positions from")
+    parser.add_argument("--moves", type=int, default=30, help="moves sampled from the start of each game")
+    parser.add_argument("--positions", type=int, default=10000, help="most common positions to keep")
+    parser.add_argument("--depth", type=int, default=6, help="expectimax depth used to search each position")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default="opening.book")
+    args = parser.parse_args(argv)
+
+    count = build_book(args.output, args.games, args.moves, args.positions, args.depth,
+                       seed=args.seed, workers=args.workers)
+    print(f"Wrote {count} positions to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,26 @@
 import time
 import random
 import tkinter as tk
-from copy import deepcopy
+from collections import OrderedDict
+
+from book import get_book
+from heuristics import get_evaluator
+from montecarlo import Game2048MonteCarloAI
+from nboard import DIRECTIONS, MAX_GRID_SIZE, MIN_GRID_SIZE, get_engine
 
 class CoreGame2048:
     """Core game logic without any visualization"""
-    def __init__(self):
-        self.grid_size = 4
+    def __init__(self, grid_size=4, seed=None):
+        if not MIN_GRID_SIZE <= grid_size <= MAX_GRID_SIZE:
+            raise ValueError(f"Grid size must be between {MIN_GRID_SIZE} and {MAX_GRID_SIZE}, got {grid_size}")
+        self.grid_size = grid_size
         self.grid = [[0] * self.grid_size for _ in range(self.grid_size)]
         self.score = 0
+
+        # Each game has its own RNG so it can be replayed from the seed and its moves (see replay.py)
+        self.seed = seed if seed is not None else random.getrandbits(64)
+        self.rng = random.Random(self.seed)
+        self.move_log = []  # indices into DIRECTIONS of every valid move played
         
         # Initialize game
         self.add_new_tile()
@@ -20,8 +32,8 @@ class CoreGame2048:
             for j in range(self.grid_size) if self.grid[i][j] == 0
         ]
         if empty_cells:
-            i, j = random.choice(empty_cells)
-            self.grid[i][j] = 2 if random.random() < 0.9 else 4
+            i, j = self.rng.choice(empty_cells)
+            self.grid[i][j] = 2 if self.rng.random() < 0.9 else 4
 
     def _merge_line(self, line, direction):
         """Helper function to merge a single line in the given direction"""
@@ -54,23 +66,22 @@ class CoreGame2048:
         return new_line, score_increase
 
     def is_valid_move(self, direction, grid=None):
+        """A move is valid if some tile has an empty cell or an equal tile in front of it"""
         if grid is None:
             grid = self.grid
-            
-        test_grid = [row[:] for row in grid]
-        
+
         if direction in ["left", "right"]:
-            for i in range(self.grid_size):
-                line = test_grid[i][:]
-                test_grid[i] = self._merge_line(line, direction)[0]
+            lines = grid
         else:  # up or down
-            for j in range(self.grid_size):
-                line = [test_grid[i][j] for i in range(self.grid_size)]
-                new_line, _ = self._merge_line(line, direction)
-                for i in range(self.grid_size):
-                    test_grid[i][j] = new_line[i]
+            lines = [[grid[i][j] for i in range(self.grid_size)] for j in range(self.grid_size)]
 
-        return test_grid != grid
+        for line in lines:
+            if direction in ["right", "down"]:
+                line = line[::-1]
+            for ahead, behind in zip(line, line[1:]):
+                if behind != 0 and (ahead == 0 or ahead == behind):
+                    return True
+        return False
 
     def move(self, direction):
         """Move all tiles in the given direction and merge if possible"""
@@ -99,14 +110,14 @@ class CoreGame2048:
         # Check if the grid changed
         if old_grid != self.grid:
             self.score += score_increase  # Add the total score increase here
+            self.move_log.append(DIRECTIONS.index(direction))
             self.add_new_tile()
             return True
         return False
 
     def get_possible_moves(self):
         """Returns list of valid moves"""
-        return [direction for direction in ["up", "down", "left", "right"]
-                if self.is_valid_move(direction)]
+        return [direction for direction in DIRECTIONS if self.is_valid_move(direction)]
 
     def is_game_over(self):
         """Check if game is over"""
@@ -125,13 +136,73 @@ class CoreGame2048:
         
         return board_str[:-1]
 
-class Game2048(CoreGame2048):
+class PackedGame2048(CoreGame2048):
+    """
+    Same game as CoreGame2048, stored as an immutable packed board and moved by an engine:
+    the 64-bit bitboard.py fast path for 4x4, the row table engine in nboard.py for other sizes.
+    """
+    def __init__(self, grid_size=4, seed=None):
+        self.engine = get_engine(grid_size)
+        self.board = None
+        super().__init__(grid_size, seed)
+
+    @property
+    def grid(self):
+        """List-of-lists view of the board. Edits to the returned lists are not written back, assign a new grid instead."""
+        return self.engine.to_grid(self.board)
+
+    @grid.setter
+    def grid(self, grid):
+        self.board = self.engine.from_grid(grid)
+
+    def add_new_tile(self):
+        empty_cells = self.engine.empty_cells(self.board)
+        if empty_cells:
+            index = self.rng.choice(empty_cells)
+            self.board = self.engine.set_cell(self.board, index, 1 if self.rng.random() < 0.9 else 2)
+
+    def is_valid_move(self, direction, grid=None):
+        board = self.board if grid is None else self.engine.from_grid(grid)
+        return self.engine.is_valid_move(board, direction)
+
+    def move(self, direction):
+        """Move all tiles in the given direction and merge if possible"""
+        if direction not in self.engine.DIRECTIONS:
+            return False
+
+        new_board, score_increase = self.engine.move(self.board, direction)
+        if new_board != self.board:
+            self.board = new_board
+            self.score += score_increase
+            self.move_log.append(DIRECTIONS.index(direction))
+            self.add_new_tile()
+            return True
+        return False
+
+    def replay_move(self, direction_index):
+        """Plays a move already known to be valid (from a move log), skipping the validity check"""
+        self.board, score_increase = self.engine.move(self.board, DIRECTIONS[direction_index])
+        self.score += score_increase
+        self.move_log.append(direction_index)
+        self.add_new_tile()
+
+    def get_possible_moves(self):
+        """Returns list of valid moves"""
+        return self.engine.possible_moves(self.board)
+
+class Game2048(PackedGame2048):
     """Game with visualization layer"""
-    def __init__(self):
-        super().__init__()
+    def __init__(self, grid_size=4, seed=None):
+        super().__init__(grid_size, seed)
         self.root = tk.Tk()
         self.root.title("2048")
         self.cell_size = 100
+        # Options passed to each policy when the AI Move button is pressed
+        self.ai_options = {
+            "expectimax": {"max_depth": 8, "time_budget_ms": 200},
+            "montecarlo": {"rollouts": 200},
+            "random": {},
+        }
         
         # Setup visualization
         self.setup_visualization()
@@ -153,6 +224,11 @@ class Game2048(CoreGame2048):
         # Add AI Move button
         self.ai_button = tk.Button(self.button_frame, text="AI Move", command=self.make_ai_move)
         self.ai_button.pack(side=tk.LEFT)
+
+        # AI policy selection
+        self.ai_policy = tk.StringVar(self.root, value="expectimax")
+        self.ai_menu = tk.OptionMenu(self.button_frame, self.ai_policy, *AI_POLICIES)
+        self.ai_menu.pack(side=tk.LEFT)
         
         # Colors for different numbers
         self.colors = {
@@ -184,6 +260,7 @@ class Game2048(CoreGame2048):
 
     def draw_grid(self):
         self.canvas.delete("all")
+        grid = self.grid
         for i in range(self.grid_size):
             for j in range(self.grid_size):
                 x1 = j * self.cell_size + 5
@@ -191,7 +268,7 @@ class Game2048(CoreGame2048):
                 x2 = x1 + self.cell_size - 10
                 y2 = y1 + self.cell_size - 10
                 
-                value = self.grid[i][j]
+                value = grid[i][j]
                 color = self.colors.get(value, "#ff0000")
                 
                 self.canvas.create_rectangle(x1, y1, x2, y2, fill=color, width=0)
@@ -208,32 +285,59 @@ class Game2048(CoreGame2048):
         self.score_label.config(text=f"Score: {self.score}")
 
     def make_ai_move(self):
-        """Handler for AI Move button"""
-        ai = Game2048AI(self)
-        if not ai.is_game_over():
-            ai.play_best_move()
-            self.draw_grid()  # Update the visual grid
-            self.update_score()  # Update the score display
+        """Handler for AI Move button, plays one move with the selected policy"""
+        policy = self.ai_policy.get()
+        ai = AI_POLICIES[policy](self, **self.ai_options.get(policy, {}))
+        t0 = time.time()
+        best_move, _ = ai.get_best_move()
+        if best_move is None:
+            print("GAME OVER - NO MORE VALID MOVES POSSIBLE!")
+            return
+        print(f'{policy}: "{best_move}" found in {time.time() - t0:.2f}s')
+        self.handle_move(best_move)
 
     def run(self):
         self.root.mainloop()
 
+class SearchTimeout(Exception):
+    """Raised inside the search when the per-move time budget runs out"""
+
 class Game2048AI:
-    def __init__(self, game):
+    def __init__(self, game, max_depth=4, time_budget_ms=None, evaluator=None, book=None,
+                 cache_size=200000, min_probability=0.0001):
         self.game = game
-        self.max_depth = 8
-        
+        # Opening book (path or OpeningBook) consulted before searching, 4x4 only
+        self.book = get_book(book) if isinstance(book, str) else book
+        self.book_hit = False
+        self.engine = getattr(game, 'engine', None) or get_engine(game.grid_size)
+        self.evaluator = get_evaluator(evaluator)  # None, a weights config (dict or JSON path) or an Evaluator
+        self.max_depth = max_depth  # counted in plies: each move and each tile spawn is one level
+        self.time_budget_ms = time_budget_ms  # None searches to max_depth without a time limit
+        self.deadline = None
+        self.nodes = 0
+        self.completed_depth = 0  # depth of the last fully searched iteration
+        self.min_probability = min_probability  # stop expanding branches less likely than this
+        self.cache_size = cache_size
+        # {(board, depth): (value, probability)} for move nodes, least recently used evicted first
+        self.cache = OrderedDict()
+
+    def get_board(self):
+        """Returns the live game as an immutable packed board"""
+        if isinstance(self.game, PackedGame2048):
+            return self.game.board
+        return self.engine.from_grid(self.game.grid)
+
     def get_state(self):
-        """Returns current grid state and score"""
-        return deepcopy(self.game.grid), deepcopy(self.game.score)
+        """Returns current board and score"""
+        return self.get_board(), self.game.score
     
     def get_score(self):
         """Calculate current score (sum of all tiles)"""
-        return sum(sum(row) for row in self.game.grid)
+        return self.engine.tile_sum(self.get_board())
     
     def get_empty_cells(self):
         """Returns number of empty cells"""
-        return sum(row.count(0) for row in self.game.grid)
+        return self.engine.count_empty(self.get_board())
     
     def make_move(self, direction):
         """
@@ -245,116 +349,118 @@ class Game2048AI:
     
     def get_possible_moves(self):
         """Returns list of valid moves"""
-        moves = []
-        for direction in ["up", "down", "left", "right"]:
-            if self.game.is_valid_move(direction, self.game.grid):
-                moves.append(direction)
-        return moves
+        return self.engine.possible_moves(self.get_board())
     
     def is_game_over(self):
         """Check if game is over"""
         return len(self.get_possible_moves()) == 0
 
-    def get_best_move(self):
-        """Returns the best move and its evaluation score using minimax"""
-        best_score = float('-inf')
-        best_move = None
-        
-        # Add timeout protection
-        start_time = time.time()
-        timeout = 5  # 5 seconds maximum
-        
-        for move in self.get_possible_moves():
-            if time.time() - start_time > timeout:
-                print("Search timed out")
+    def get_best_move(self, time_budget_ms=None):
+        """
+        Returns the best move and its evaluation score using iterative deepening expectimax.
+        Searches depth 1, 2, ... up to max_depth and stops once time_budget_ms (or self.time_budget_ms)
+        runs out. The result always comes from the deepest iteration that finished; depth 1 always finishes.
+        """
+        if time_budget_ms is None:
+            time_budget_ms = self.time_budget_ms
+        board = self.get_board()
+        moves = self.engine.possible_moves(board)
+        if not moves:
+            return None, float('-inf')
+
+        self.book_hit = False
+        if self.book is not None and self.game.grid_size == 4:
+            entry = self.book.lookup(board)
+            if entry is not None and entry[0] in moves:
+                self.book_hit = True
+                return entry
+
+        start_time = time.perf_counter()
+        best_move, best_score = None, float('-inf')
+        self.completed_depth = 0
+        for depth in range(1, self.max_depth + 1):
+            if depth > 1 and time_budget_ms is not None:
+                self.deadline = start_time + time_budget_ms / 1000
+            try:
+                scores = self.search_root(board, moves, depth)
+            except SearchTimeout:
                 break
-                
-            # Create a deep copy for simulation
-            test_grid = deepcopy(self.game.grid)
-            test_score = self.game.score
-            
-            # Try move on the copy
-            self.game.grid = deepcopy(test_grid)
-            if self.make_move(move):
-                score = self.minimax(self.max_depth - 1, False, start_time, timeout)
-                
-                if score > best_score:
-                    best_score = score
-                    best_move = move
-            
-            # Restore original state
-            self.game.grid = test_grid
-            self.game.score = test_score
-        
+            finally:
+                self.deadline = None
+
+            # Reuse this iteration's ranking as move ordering for the next one
+            moves.sort(key=scores.get, reverse=True)
+            best_move, best_score = moves[0], scores[moves[0]]
+            self.completed_depth = depth
+
         return best_move, best_score
+
+    def search_root(self, board, moves, depth):
+        """Returns {move: score} for every move searched to the given depth"""
+        scores = {}
+        for move in moves:
+            new_board, _ = self.engine.move(board, move)
+            scores[move] = self.expectimax_chance(new_board, depth - 1, 1.0)
+        return scores
+
+    def check_deadline(self):
+        """Counts a search node, reading the clock every 16 so a small time budget is not overrun by much"""
+        self.nodes += 1
+        if self.deadline is not None and self.nodes & 15 == 0 and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    def expectimax_move(self, board, depth, probability):
+        """Value of a board where the player is about to move"""
+        self.check_deadline()
+        if depth <= 0 or probability < self.min_probability:
+            return self.evaluate_position(board)
+
+        # A value searched at a lower probability had more of its subtree cut off by min_probability, so only
+        # entries searched at least as thoroughly are reused
+        key = (board, depth)
+        entry = self.cache.get(key)
+        if entry is not None and entry[1] >= probability:
+            self.cache.move_to_end(key)
+            return entry[0]
+
+        best = None
+        for move in self.engine.DIRECTIONS:
+            new_board, _ = self.engine.move(board, move)
+            if new_board != board:
+                score = self.expectimax_chance(new_board, depth - 1, probability)
+                if best is None or score > best:
+                    best = score
+        if best is None:  # No moves left, game over
+            best = self.evaluator.lost_score
+
+        self.cache[key] = (best, probability)
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return best
+
+    def expectimax_chance(self, board, depth, probability):
+        """Value of a board waiting for a new tile: a 2 (p=0.9) or 4 (p=0.1) in any empty cell"""
+        self.check_deadline()
+        if depth <= 0:
+            return self.evaluate_position(board)
+
+        empty_cells = self.engine.empty_cells(board)
+        if not empty_cells:
+            return self.evaluate_position(board)
+
+        cell_probability = probability / len(empty_cells)
+        total = 0.0
+        for index in empty_cells:
+            total += 0.9 * self.expectimax_move(self.engine.set_cell(board, index, 1), depth - 1, cell_probability * 0.9)
+            total += 0.1 * self.expectimax_move(self.engine.set_cell(board, index, 2), depth - 1, cell_probability * 0.1)
+        return total / len(empty_cells)
     
-    def minimax(self, depth, is_maximizing, start_time, timeout):
-        """Minimax algorithm with depth limit and timeout"""
-        if time.time() - start_time > timeout:
-            return self.evaluate_position()
-            
-        if depth == 0 or self.is_game_over():
-            return self.evaluate_position()
-        
-        if is_maximizing:
-            max_eval = float('-inf')
-            for move in self.get_possible_moves():
-                # Create a deep copy for simulation
-                test_grid = deepcopy(self.game.grid)
-                test_score = self.game.score
-                
-                # Try move on the copy
-                self.game.grid = deepcopy(test_grid)
-                if self.make_move(move):
-                    eval = self.minimax(depth - 1, False, start_time, timeout)
-                    max_eval = max(max_eval, eval)
-                
-                # Restore state
-                self.game.grid = test_grid
-                self.game.score = test_score
-            
-            return max_eval if max_eval != float('-inf') else self.evaluate_position()
-        
-        else:  # Simulating random tile placement
-            min_eval = float('inf')
-            empty_cells = [(i, j) for i in range(self.game.grid_size) 
-                          for j in range(self.game.grid_size) 
-                          if self.game.grid[i][j] == 0]
-            
-            if not empty_cells:
-                return self.evaluate_position()
-            
-            # Sample a few random positions for efficiency
-            sample_size = min(2, len(empty_cells))  # Reduced sample size
-            for i, j in random.sample(empty_cells, sample_size):
-                for new_tile in [2]:  # Only try value 2 for efficiency
-                    # Create a deep copy for simulation
-                    test_grid = deepcopy(self.game.grid)
-                    
-                    # Place new tile
-                    self.game.grid = deepcopy(test_grid)
-                    self.game.grid[i][j] = new_tile
-                    eval = self.minimax(depth - 1, True, start_time, timeout)
-                    min_eval = min(min_eval, eval)
-                    
-                    # Restore state
-                    self.game.grid = test_grid
-            
-            return min_eval if min_eval != float('inf') else self.evaluate_position()
-    
-    def evaluate_position(self):
-        """
-        Evaluate the current position based on:
-        1. Total sum of all tiles
-        2. Number of empty cells (weighted)
-        """
-        total_sum = sum(sum(row) for row in self.game.grid)
-        empty_cells = self.get_empty_cells()
-        
-        # Weight empty cells more heavily
-        empty_cell_weight = 10.0
-        
-        return total_sum + (empty_cells * empty_cell_weight)
+    def evaluate_position(self, board=None):
+        """Evaluate the position (the live game if board is None) with the heuristic evaluator"""
+        if board is None:
+            board = self.get_board()
+        return self.evaluator(board, self.engine)
 
     def play_best_move(self):
         """Makes the best move according to the recursive search"""
@@ -371,14 +477,33 @@ class Game2048AI:
         best_move, _ = self.get_best_move()
         print(f'get_possible_moves: {self.get_possible_moves()}')
         print(f'Board after get_best_move:\n{str(self.game)}')
-        print(f'Best move: "{best_move}" found in {time.time() - t0:.2f}s ')
+        print(f'Best move: "{best_move}" found in {time.time() - t0:.2f}s (depth {self.completed_depth})')
         if best_move:
             self.make_move(best_move)
             print(f'New board:\n{str(self.game)}')
         else:
             print('WARNING, no best move found.')
 
+class Game2048RandomAI:
+    """Baseline policy, plays a uniformly random valid move"""
+    def __init__(self, game):
+        self.game = game
+
+    def get_best_move(self):
+        moves = self.game.get_possible_moves()
+        if not moves:
+            return None, float('-inf')
+        return random.choice(moves), 0.0
+
+# Policies selectable by name, each takes the game as first argument and provides get_best_move()
+AI_POLICIES = {
+    "expectimax": Game2048AI,
+    "montecarlo": Game2048MonteCarloAI,
+    "random": Game2048RandomAI,
+}
+
 # Remove the ai_player function and the automatic AI setup
 if __name__ == "__main__":
-    game = Game2048()
+    import sys
+    game = Game2048(int(sys.argv[1]) if len(sys.argv) > 1 else 4)
     game.run()
\ No newline at end of file
@@ -0,0 +1,168 @@
+"""
+Pluggable board evaluation for the 2048 AI.
+
+Every term scores a single row of log2 exponents. Each term is precomputed
+for all 65536 possible rows, and the weighted sum of the terms is folded into
+one table, so evaluating a board is 8 lookups: its 4 rows plus the 4 rows of
+its transpose (the columns). Other board sizes score each row and column
+directly and memoize the result per line.
+
+Weights come from DEFAULT_WEIGHTS, a dict, or a JSON config file:
+
+    {"weights": {"empty": 270, "monotonicity": 47}, "lost_score": -200000}
+
+or the weights alone, {"empty": 270, "monotonicity": 47}.
+
+New terms can be added with register_term(name, func).
+"""
+import json
+from functools import lru_cache
+
+import bitboard
+
+ROW_MASK = bitboard.ROW_MASK
+
+
+def empty_term(row):
+    """Number of empty cells"""
+    return row.count(0)
+
+
+def merges_term(row):
+    """Number of equal neighbours once the row is slid together, i.e. merges available"""
+    tiles = [e for e in row if e]
+    return sum(1 for a, b in zip(tiles, tiles[1:]) if a == b)
+
+
+def monotonicity_term(row, power=4):
+    """Penalty for breaking the order of the row, in whichever direction it is closest to sorted"""
+    left = right = 0
+    for a, b in zip(row, row[1:]):
+        if a > b:
+            left += a ** power - b ** power
+        else:
+            right += b ** power - a ** power
+    return -min(left, right)
+
+
+def smoothness_term(row):
+    """Penalty for exponent gaps between neighbouring tiles"""
+    tiles = [e for e in row if e]
+    return -sum(abs(a - b) for a, b in zip(tiles, tiles[1:]))
+
+
+def edges_term(row):
+    """Value of the tiles at both ends of the row: the board's edges, corners count twice (row and column)"""
+    return sum(1 << e for e in (row[0], row[-1]) if e)
+
+
+def tiles_term(row):
+    """Sum of tile values"""
+    return sum(1 << e for e in row if e)
+
+
+TERMS = {
+    "empty": empty_term,
+    "merges": merges_term,
+    "monotonicity": monotonicity_term,
+    "smoothness": smoothness_term,
+    "edges": edges_term,
+    "tiles": tiles_term,
+}
+
+DEFAULT_WEIGHTS = {
+    "empty": 270.0,
+    "merges": 700.0,
+    "monotonicity": 47.0,
+    "smoothness": 10.0,
+    "edges": 0.0,
+    "tiles": 0.0,
+}
+
+LOST_SCORE = -200000.0  # value of a finished game
+
+
+def register_term(name, func):
+    """Adds a per-row term. func takes a list of exponents and returns a number."""
+    TERMS[name] = func
+    _term_table.cache_clear()
+    _cached_evaluator.cache_clear()  # evaluators built before still use the old function
+
+
+@lru_cache(maxsize=None)
+def _term_table(name):
+    """A term evaluated for every possible row, calculated once per process"""
+    func = TERMS[name]
+    return [func(bitboard.unpack_row(row)) for row in range(65536)]
+
+
+class Evaluator:
+    def __init__(self, weights=None, lost_score=LOST_SCORE):
+        weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        unknown = set(weights) - set(TERMS)
+        if unknown:
+            raise ValueError(f"Unknown heuristic terms: {sorted(unknown)}")
+        self.weights = weights
+        self.lost_score = lost_score
+
+        # Weighted sum of all terms for every row
+        table = [0.0] * 65536
+        for name, weight in weights.items():
+            if weight:
+                table = [total + weight * value for total, value in zip(table, _term_table(name))]
+        self.row_table = table
+        self.line_cache = {}  # {line: score} for boards that are not 4x4
+
+    def line_score(self, line):
+        """Weighted terms for a row or column of any length, memoized"""
+        score = self.line_cache.get(line)
+        if score is None:
+            cells = list(line)
+            score = sum(weight * TERMS[name](cells) for name, weight in self.weights.items() if weight)
+            self.line_cache[line] = score
+        return score
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Builds an evaluator from a dict or a path to a JSON file with "weights" and optional "lost_score",
+        or with the weights alone. Unknown keys raise ValueError rather than being ignored.
+        """
+        if isinstance(config, str):
+            with open(config) as f:
+                config = json.load(f)
+        if "weights" not in config and "lost_score" not in config:
+            return cls(config)  # a bare weights mapping, checked against TERMS
+        unknown = set(config) - {"weights", "lost_score"}
+        if unknown:
+            raise ValueError(f"Unknown heuristic config keys: {sorted(unknown)}")
+        return cls(config.get("weights"), config.get("lost_score", LOST_SCORE))
+
+    def __call__(self, board, engine=bitboard):
+        """Evaluates a board of the given engine, 8 table lookups for a 4x4 bitboard"""
+        if engine is not bitboard:
+            return sum(self.line_score(line) for line in engine.lines(board))
+        table = self.row_table
+        transposed = bitboard.transpose(board)
+        return (table[board & ROW_MASK] + table[(board >> 16) & ROW_MASK]
+                + table[(board >> 32) & ROW_MASK] + table[board >> 48]
+                + table[transposed & ROW_MASK] + table[(transposed >> 16) & ROW_MASK]
+                + table[(transposed >> 32) & ROW_MASK] + table[transposed >> 48])
+
+
+@lru_cache(maxsize=16)
+def _cached_evaluator(config_json):
+    return Evaluator.from_config(json.loads(config_json))
+
+
+def get_evaluator(config=None):
+    """
+    Shared evaluator for a config (None for the defaults, a dict, a JSON path or an Evaluator),
+    so AIs created per move or per game do not rebuild the tables.
+    """
+    if isinstance(config, Evaluator):
+        return config
+    if isinstance(config, str):
+        with open(config) as f:
+            config = json.load(f)
+    return _cached_evaluator(json.dumps(config or {}, sort_keys=True))
@@ -0,0 +1,147 @@
+"""
+Monte-Carlo rollout policy for 2048.
+
+For every valid move, plays K games to the end (random or greedy playouts) and
+picks the move with the best mean final score. Rollouts are sent to a process
+pool in rounds; after each round, moves whose score is clearly worse than the
+leader (upper confidence bound below the leader's lower bound) are dropped, so
+the budget goes to the moves that are still in contention.
+"""
+import math
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+from nboard import get_engine
+
+ROLLOUT_POLICIES = ("random", "greedy")
+
+_pools = {}
+
+
+def _get_pool(workers):
+    """Pools are shared between AI instances, the GUI creates a new AI on every click"""
+    if workers not in _pools:
+        _pools[workers] = ProcessPoolExecutor(max_workers=workers)
+    return _pools[workers]
+
+
+def rollout(engine, board, rng, greedy=False):
+    """Spawns a tile and keeps playing until the game ends. Returns the score gained along the way."""
+    score = 0
+    while True:
+        empty_cells = engine.empty_cells(board)
+        if empty_cells:
+            board = engine.set_cell(board, rng.choice(empty_cells), 1 if rng.random() < 0.9 else 2)
+
+        options = []
+        for direction in engine.DIRECTIONS:
+            new_board, gained = engine.move(board, direction)
+            if new_board != board:
+                options.append((gained, new_board))
+        if not options:
+            return score
+
+        if greedy:
+            best_gain = max(gained for gained, _ in options)
+            options = [option for option in options if option[0] == best_gain]
+        gained, board = rng.choice(options)
+        score += gained
+
+
+def run_rollouts(grid_size, board, count, seed, greedy=False):
+    """Runs count rollouts from a board that just moved. Top level so it can be sent to worker processes."""
+    engine = get_engine(grid_size)
+    rng = random.Random(seed)
+    return [rollout(engine, board, rng, greedy) for _ in range(count)]
+
+
+class Game2048MonteCarloAI:
+    def __init__(self, game, rollouts=200, rollout_policy="random", rollout_workers=None,
+                 rounds=8, confidence=2.0):
+        if rollout_policy not in ROLLOUT_POLICIES:
+            raise ValueError(f"Unknown rollout policy: {rollout_policy}")
+        self.game = game
+        self.grid_size = game.grid_size
+        self.engine = get_engine(game.grid_size)
+        self.rollouts = rollouts  # maximum playouts per move
+        self.greedy = rollout_policy == "greedy"
+        self.rollout_workers = rollout_workers  # None uses every core, 1 runs in this process
+        self.rounds = rounds  # the budget is spent in this many rounds, pruning between them
+        self.confidence = confidence  # z-score used to decide a move is clearly worse
+        self.rng = random.Random(random.getrandbits(64))
+        self.rollouts_used = 0
+
+    def get_board(self):
+        board = getattr(self.game, "board", None)
+        return board if board is not None else self.engine.from_grid(self.game.grid)
+
+    def get_possible_moves(self):
+        return self.engine.possible_moves(self.get_board())
+
+    def is_game_over(self):
+        return len(self.get_possible_moves()) == 0
+
+    def get_best_move(self):
+        """Returns the move with the best mean final score and that mean (relative to the current score)"""
+        board = self.get_board()
+        candidates = {}  # {move: (board after move, score gained by the move)}
+        for direction in self.engine.DIRECTIONS:
+            new_board, gained = self.engine.move(board, direction)
+            if new_board != board:
+                candidates[direction] = (new_board, gained)
+        if not candidates:
+            return None, float('-inf')
+        if len(candidates) == 1:
+            move = next(iter(candidates))
+            return move, float(candidates[move][1])
+
+        results = {move: [] for move in candidates}
+        chunk = max(1, math.ceil(self.rollouts / self.rounds))
+        self.rollouts_used = 0
+        done = 0
+        while done < self.rollouts:
+            count = min(chunk, self.rollouts - done)
+            done += count
+            for move, scores in zip(candidates, self._run_round(candidates, count)):
+                gained = candidates[move][1]
+                results[move].extend(gained + s for s in scores)
+                self.rollouts_used += len(scores)
+
+            candidates = self._prune(candidates, results)
+            if len(candidates) == 1:
+                break
+
+        means = {move: sum(results[move]) / len(results[move]) for move in candidates}
+        best_move = max(means, key=means.get)
+        return best_move, means[best_move]
+
+    def _run_round(self, candidates, count):
+        jobs = [(self.grid_size, new_board, count, self.rng.getrandbits(64), self.greedy)
+                for new_board, _ in candidates.values()]
+        if self.rollout_workers == 1:
+            return [run_rollouts(*job) for job in jobs]
+
+        pool = _get_pool(self.rollout_workers)
+        workers = self.rollout_workers or os.cpu_count()
+        # Split each move's rollouts so every worker has something to do
+        splits = max(1, workers // len(jobs))
+        futures = []
+        for grid_size, new_board, total, seed, greedy in jobs:
+            part = math.ceil(total / splits)
+            counts = [min(part, total - i * part) for i in range(splits) if total - i * part > 0]
+            futures.append([pool.submit(run_rollouts, grid_size, new_board, c, seed + i, greedy)
+                            for i, c in enumerate(counts)])
+        return [[s for future in move_futures for s in future.result()] for move_futures in futures]
+
+    def _prune(self, candidates, results):
+        """Drops moves whose upper bound is below the best lower bound"""
+        bounds = {}
+        for move in candidates:
+            scores = results[move]
+            mean = sum(scores) / len(scores)
+            variance = sum((s - mean) ** 2 for s in scores) / max(len(scores) - 1, 1)
+            margin = self.confidence * math.sqrt(variance / len(scores))
+            bounds[move] = (mean - margin, mean + margin)
+        best_lower = max(lower for lower, _ in bounds.values())
+        return {move: value for move, value in candidates.items() if bounds[move][1] >= best_lower}
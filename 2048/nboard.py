@@ -0,0 +1,151 @@
+"""
+Board engines for 2048 of any size from 3x3 to 8x8.
+
+An engine provides the same functions as the bitboard.py module (move,
+possible_moves, empty_cells, set_cell, from_grid, to_grid, ...) so games and
+the AI can use either one. get_engine(4) returns bitboard.py itself, the
+specialized 4x4 fast path. Other sizes get a RowTableEngine, which keeps a
+board as immutable bytes of log2 exponents (hashable, so the AI can cache it)
+and moves it one line at a time through tables of moved lines. A line is a
+bytes slice of the board (board[i::n] for a column), and the tables are keyed
+by it. They are filled on first use rather than precomputed, because 5x5 and
+larger boards have too many possible lines (and no 15 exponent cap) while a
+game only ever sees a few thousand. See bench_nboard.py for the speed against
+the list implementation.
+"""
+import bitboard
+
+DIRECTIONS = bitboard.DIRECTIONS
+MIN_GRID_SIZE, MAX_GRID_SIZE = 3, 8
+MAX_TABLE_LINES = 1 << 18  # a table is cleared when it grows past this many lines
+
+
+def _merge_line_left(line):
+    """Same merge rule as CoreGame2048._merge_line, on a bytes line of exponents. Returns (moved line, score)."""
+    merged = []
+    prev = None
+    score = 0
+    for num in line:
+        if not num:
+            continue
+        if prev is None:
+            prev = num
+        elif prev == num:
+            merged.append(num + 1)
+            score += 1 << (num + 1)
+            prev = None
+        else:
+            merged.append(prev)
+            prev = num
+    if prev is not None:
+        merged.append(prev)
+    return bytes(merged) + bytes(len(line) - len(merged)), score
+
+
+class RowTableEngine:
+    DIRECTIONS = DIRECTIONS
+
+    def __init__(self, grid_size):
+        self.grid_size = grid_size
+        self.cell_count = grid_size * grid_size
+        self.start_table = {}  # {line: (line moved towards its start, score)}, for left and up
+        self.end_table = {}  # {line: (line moved towards its end, score)}, for right and down
+
+    def _table(self, direction):
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Unknown direction: {direction}")
+        return self.end_table if direction in ("right", "down") else self.start_table
+
+    def _moved_line(self, table, line):
+        if len(table) >= MAX_TABLE_LINES:
+            table.clear()
+        if table is self.end_table:
+            moved, score = _merge_line_left(line[::-1])
+            entry = table[line] = (moved[::-1], score)
+        else:
+            entry = table[line] = _merge_line_left(line)
+        return entry
+
+    def _lines(self, board, direction):
+        n = self.grid_size
+        if direction in ("left", "right"):
+            return [board[i:i + n] for i in range(0, self.cell_count, n)]
+        return [board[i::n] for i in range(n)]
+
+    def move(self, board, direction):
+        """Returns (new_board, score_increase). new_board == board if the move is invalid."""
+        table = self._table(direction)
+        score = 0
+        moved_lines = []
+        for line in self._lines(board, direction):
+            entry = table.get(line) or self._moved_line(table, line)
+            moved_lines.append(entry[0])
+            score += entry[1]
+        if direction in ("left", "right"):
+            return b"".join(moved_lines), score
+
+        n = self.grid_size
+        new_board = bytearray(self.cell_count)
+        for i, column in enumerate(moved_lines):
+            new_board[i::n] = column
+        return bytes(new_board), score
+
+    def is_valid_move(self, board, direction):
+        """A move is valid if it changes some line"""
+        table = self._table(direction)
+        for line in self._lines(board, direction):
+            entry = table.get(line) or self._moved_line(table, line)
+            if entry[0] != line:
+                return True
+        return False
+
+    def possible_moves(self, board):
+        return [direction for direction in DIRECTIONS if self.is_valid_move(board, direction)]
+
+    def empty_cells(self, board):
+        """Flat indices (grid_size * row + col) of the empty cells, in row-major order"""
+        return [i for i, e in enumerate(board) if not e]
+
+    def count_empty(self, board):
+        return board.count(0)
+
+    def set_cell(self, board, index, exponent):
+        return board[:index] + bytes((exponent,)) + board[index + 1:]
+
+    def max_tile(self, board):
+        exponent = max(board)
+        return 1 << exponent if exponent else 0
+
+    def tile_sum(self, board):
+        return sum(1 << e for e in board if e)
+
+    def lines(self, board):
+        """All rows and columns as tuples of exponents"""
+        return [tuple(line) for line in self._lines(board, "left") + self._lines(board, "up")]
+
+    def from_grid(self, grid):
+        exponents = []
+        for value in (v for row in grid for v in row):
+            exponent = value.bit_length() - 1 if value else 0
+            if value and value != 1 << exponent:
+                raise ValueError(f"Tile {value} is not a power of two")
+            exponents.append(exponent)
+        return bytes(exponents)
+
+    def to_grid(self, board):
+        n = self.grid_size
+        return [[1 << e if e else 0 for e in board[r * n:(r + 1) * n]] for r in range(n)]
+
+
+_engines = {}
+
+
+def get_engine(grid_size):
+    """bitboard.py for 4x4, a shared RowTableEngine for other sizes"""
+    if not MIN_GRID_SIZE <= grid_size <= MAX_GRID_SIZE:
+        raise ValueError(f"Grid size must be between {MIN_GRID_SIZE} and {MAX_GRID_SIZE}, got {grid_size}")
+    if grid_size == bitboard.GRID_SIZE:
+        return bitboard
+    if grid_size not in _engines:
+        _engines[grid_size] = RowTableEngine(grid_size)
+    return _engines[grid_size]
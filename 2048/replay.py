@@ -0,0 +1,77 @@
+"""
+Compact replay log for 2048 games.
+
+A game is fully determined by its grid size, its RNG seed and the moves played,
+so that is all a record stores: a 16 byte header followed by the moves at 2 bits
+each (4 per byte, first move in the lowest bits). Records are simply
+concatenated in a file. Any position is rebuilt by replaying the moves from the
+seed, without re-checking that each move is valid.
+
+    header: magic b"2048", version (u8), grid size (u8), seed (u64), move count (u32)
+"""
+import struct
+from collections import namedtuple
+
+from game import PackedGame2048
+
+MAGIC = b"2048"
+VERSION = 1
+HEADER = struct.Struct("<4sBBQI")
+
+GameRecord = namedtuple("GameRecord", ["grid_size", "seed", "moves"])
+
+
+def pack_moves(moves):
+    data = bytearray((len(moves) + 3) // 4)
+    for i, move in enumerate(moves):
+        data[i >> 2] |= move << (2 * (i & 3))
+    return bytes(data)
+
+
+def unpack_moves(data, count):
+    return [(data[i >> 2] >> (2 * (i & 3))) & 3 for i in range(count)]
+
+
+def encode(seed, moves, grid_size=4):
+    return HEADER.pack(MAGIC, VERSION, grid_size, seed, len(moves)) + pack_moves(moves)
+
+
+def encode_game(game):
+    return encode(game.seed, game.move_log, game.grid_size)
+
+
+def decode(data, offset=0):
+    """Returns (GameRecord, offset of the next record)"""
+    magic, version, grid_size, seed, count = HEADER.unpack_from(data, offset)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a 2048 replay record at offset {offset}")
+    start = offset + HEADER.size
+    end = start + (count + 3) // 4
+    return GameRecord(grid_size, seed, unpack_moves(data[start:end], count)), end
+
+
+def write_games(f, games):
+    """Appends games (PackedGame2048 or GameRecord) to a binary file object"""
+    for game in games:
+        if isinstance(game, GameRecord):
+            f.write(encode(game.seed, game.moves, game.grid_size))
+        else:
+            f.write(encode_game(game))
+
+
+def read_games(f):
+    """Yields every GameRecord in a binary file object"""
+    data = f.read()
+    offset = 0
+    while offset < len(data):
+        record, offset = decode(data, offset)
+        yield record
+
+
+def replay(record, upto=None):
+    """Rebuilds the game after the first upto moves of a record (all of them if None)"""
+    game = PackedGame2048(record.grid_size, seed=record.seed)
+    moves = record.moves if upto is None else record.moves[:upto]
+    for move in moves:
+        game.replay_move(move)
+    return game
@@ -0,0 +1,137 @@
+"""
+Headless batch self-play for 2048.
+
+Plays many games with one of the AI_POLICIES across a process pool and streams
+one JSON line per finished game. Every game is seeded with seed + game index,
+so a run is reproducible no matter how the games are spread over workers.
+
+    python selfplay.py --games 1000 --policy expectimax --budget-ms 20 --output results.jsonl
+"""
+import argparse
+import inspect
+import json
+import os
+import random
+import sys
+import time
+from contextlib import ExitStack
+from multiprocessing import Pool
+
+import replay
+from game import AI_POLICIES, PackedGame2048
+
+
+def play_game(game_index, seed, policy_name, policy_options, grid_size=4):
+    """Plays one game to the end and returns its result record"""
+    random.seed(seed)  # policies that sample (random, montecarlo) draw from the global RNG
+    game = PackedGame2048(grid_size, seed=seed)
+    policy = AI_POLICIES[policy_name]
+    accepted = inspect.signature(policy).parameters
+    options = {k: v for k, v in policy_options.items() if k in accepted}
+
+    ai = policy(game, **options)
+    moves = 0
+    think_time = 0.0
+    t0 = time.perf_counter()
+    while True:
+        t_move = time.perf_counter()
+        best_move, _ = ai.get_best_move()
+        think_time += time.perf_counter() - t_move
+        if best_move is None or not game.move(best_move):
+            break
+        moves += 1
+
+    result = {
+        'game': game_index,
+        'seed': seed,
+        'policy': policy_name,
+        'grid_size': grid_size,
+        'score': game.score,
+        'max_tile': max(max(row) for row in game.grid),
+        'moves': moves,
+        'ms_per_move': 1000 * think_time / max(moves, 1),
+        'seconds': time.perf_counter() - t0,
+    }
+    return result, replay.encode_game(game)
+
+
+def _play_game_star(args):
+    return play_game(*args)
+
+
+def run(games, policy_name, policy_options, seed=0, workers=None, output=None, grid_size=4, replays=None):
+    """
+    Plays games in a process pool, writing each result to output (and its replay record to the
+    binary file object replays) as it finishes. Returns all results.
+    """
+    jobs = [(i, seed + i, policy_name, policy_options, grid_size) for i in range(games)]
+    results = []
+    with Pool(processes=workers) as pool:
+        for result, record in pool.imap_unordered(_play_game_star, jobs):
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+            if replays is not None:
+                replays.write(record)
+    return results
+
+
+def summarize(results):
+    scores = sorted(r['score'] for r in results)
+    max_tiles = {}
+    for r in results:
+        max_tiles[r['max_tile']] = max_tiles.get(r['max_tile'], 0) + 1
+    return {
+        'games': len(results),
+        'mean_score': sum(scores) / len(scores),
+        'median_score': scores[len(scores) // 2],
+        'max_score': scores[-1],
+        'max_tile_counts': dict(sorted(max_tiles.items())),
+        'mean_ms_per_move': sum(r['ms_per_move'] for r in results) / len(results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless 2048 self-play')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--size', type=int, default=4, help='board size, 3 to 8')
+    parser.add_argument('--policy', choices=sorted(AI_POLICIES), default='expectimax')
+    parser.add_argument('--max-depth', type=int, default=None)
+    parser.add_argument('--budget-ms', type=float, default=None, help='per-move time budget')
+    parser.add_argument('--weights', default=None, help='JSON heuristic config for expectimax')
+    parser.add_argument('--book', default=None, help='opening book for expectimax (see book.py)')
+    parser.add_argument('--rollouts', type=int, default=None, help='montecarlo playouts per move')
+    parser.add_argument('--rollout-policy', choices=['random', 'greedy'], default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='-', help='JSONL file for per-game results, - for stdout')
+    parser.add_argument('--replays', default=None, help='binary file to append replay records to (see replay.py)')
+    args = parser.parse_args(argv)
+    if args.games < 1:
+        parser.error('--games must be at least 1')
+
+    policy_options = {
+        'max_depth': args.max_depth,
+        'time_budget_ms': args.budget_ms,
+        'evaluator': args.weights,
+        'book': args.book,
+        'rollouts': args.rollouts,
+        'rollout_policy': args.rollout_policy,
+        'rollout_workers': 1,  # games are already spread over the pool, pool workers cannot start their own
+    }
+    policy_options = {k: v for k, v in policy_options.items() if v is not None}
+
+    t0 = time.perf_counter()
+    with ExitStack() as stack:
+        output = sys.stdout if args.output == '-' else stack.enter_context(open(args.output, 'w'))
+        replays = stack.enter_context(open(args.replays, 'ab')) if args.replays else None
+        results = run(args.games, args.policy, policy_options, args.seed, args.workers, output, args.size, replays)
+
+    summary = summarize(results)
+    summary['seconds'] = time.perf_counter() - t0
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+import batch
+import bitboard
+from game import CoreGame2048
+from test_bitboard import list_move, random_grids
+
+GRIDS = list(random_grids(500, seed=3))
+
+
+@pytest.mark.parametrize("direction", bitboard.DIRECTIONS)
+def test_move_matches_merge_line(direction):
+    boards = batch.from_grids(GRIDS)
+    new_boards, scores, moved = batch.move(boards, bitboard.DIRECTIONS.index(direction))
+    for grid, new_grid, score, board_moved in zip(GRIDS, batch.to_grids(new_boards), scores, moved):
+        expected_grid, expected_score = list_move(grid, direction)
+        assert (new_grid.tolist(), int(score)) == (expected_grid, expected_score)
+        assert board_moved == (expected_grid != grid)
+
+
+def test_mixed_directions_and_valid_moves():
+    boards = batch.from_grids(GRIDS)
+    directions = np.random.default_rng(0).integers(0, 4, len(GRIDS))
+    new_grids = batch.to_grids(batch.move(boards, directions)[0])
+    valid = batch.valid_moves(boards)
+    for grid, direction, new_grid, board_valid in zip(GRIDS, directions, new_grids, valid):
+        assert new_grid.tolist() == list_move(grid, bitboard.DIRECTIONS[direction])[0]
+        game = CoreGame2048(4, seed=0)
+        game.grid = grid
+        assert [d for d, ok in zip(bitboard.DIRECTIONS, board_valid) if ok] == game.get_possible_moves()
+
+
+def test_spawns_land_in_empty_cells_with_the_2_4_split():
+    rng = np.random.default_rng(1)
+    grids = np.repeat(np.array(GRIDS[:100]), 200, axis=0)
+    before = batch.to_grids(batch.from_grids(grids))
+    after = batch.to_grids(batch.spawn_tiles(batch.from_grids(grids), rng))
+    changed = before != after
+    has_empty = (before == 0).any(axis=(1, 2))
+    assert (changed.sum(axis=(1, 2)) == has_empty).all()  # one new tile, none on full boards
+    assert (before[changed] == 0).all()
+    new_tiles = after[changed]
+    assert set(new_tiles.tolist()) <= {2, 4}
+    assert abs((new_tiles == 4).mean() - 0.1) < 0.01
+
+    # Uniform over the empty cells of a board, the first 200 boards are copies of one grid
+    counts = changed[:200].sum(axis=0)[before[0] == 0]
+    expected = 200 / len(counts)
+    assert (abs(counts - expected) < 5 * expected ** 0.5).all()
+
+
+def test_spawn_mask_and_batch_game_scores():
+    boards = batch.from_grids(GRIDS[:50])
+    where = np.arange(50) % 2 == 0
+    spawned = batch.spawn_tiles(boards, np.random.default_rng(2), where=where)
+    assert (spawned[~where] == boards[~where]).all()
+
+    game = batch.BatchGame2048(50, seed=3)
+    for _ in range(30):
+        before = game.grids.copy()
+        directions = game.random_moves()
+        scores = game.scores.copy()
+        moved = game.move(directions)
+        for i in range(50):
+            expected_grid, expected_score = list_move(before[i].tolist(), bitboard.DIRECTIONS[directions[i]])
+            assert moved[i] == (expected_grid != before[i].tolist())
+            if moved[i]:
+                assert game.scores[i] - scores[i] == expected_score
+                assert (game.grids[i] != np.array(expected_grid)).sum() == 1  # plus the spawned tile
+            else:
+                assert (game.grids[i] == before[i]).all() and game.scores[i] == scores[i]
@@ -0,0 +1,72 @@
+import itertools
+import random
+
+import pytest
+
+import bitboard
+from game import CoreGame2048
+
+
+def list_move(grid, direction):
+    """CoreGame2048's move of a grid without the new tile: (new grid, score increase)"""
+    game = CoreGame2048(4, seed=0)
+    game.grid = [row[:] for row in grid]
+    score = 0
+    for i in range(4):
+        if direction in ("left", "right"):
+            game.grid[i], line_score = game._merge_line(game.grid[i][:], direction)
+        else:
+            column, line_score = game._merge_line([game.grid[r][i] for r in range(4)], direction)
+            for r in range(4):
+                game.grid[r][i] = column[r]
+        score += line_score
+    return game.grid, score
+
+
+def random_grids(count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        yield [[rng.choice([0, 0, 0, 2, 2, 4, 8, 16, 1024]) for _ in range(4)] for _ in range(4)]
+
+
+def test_row_tables_match_merge_line():
+    game = CoreGame2048(4, seed=0)
+    for exponents in itertools.product(range(15), repeat=4):  # 15 is capped, see test_largest_tiles_do_not_merge
+        row = bitboard.pack_row(exponents)
+        line = [1 << e if e else 0 for e in exponents]
+        for direction, table, score_table in (("left", bitboard.ROW_LEFT, bitboard.ROW_SCORE_LEFT),
+                                              ("right", bitboard.ROW_RIGHT, bitboard.ROW_SCORE_RIGHT)):
+            new_line, score = game._merge_line(line[:], direction)
+            assert [1 << e if e else 0 for e in bitboard.unpack_row(table[row])] == new_line
+            assert score_table[row] == score
+
+
+@pytest.mark.parametrize("direction", bitboard.DIRECTIONS)
+def test_move_matches_list_game(direction):
+    for grid in random_grids(500):
+        board = bitboard.from_grid(grid)
+        new_board, score = bitboard.move(board, direction)
+        assert (bitboard.to_grid(new_board), score) == list_move(grid, direction)
+        assert bitboard.is_valid_move(board, direction) == (new_board != board)
+
+
+def test_possible_moves_match_list_game():
+    for grid in random_grids(500, seed=1):
+        game = CoreGame2048(4, seed=0)
+        game.grid = grid
+        assert bitboard.possible_moves(bitboard.from_grid(grid)) == game.get_possible_moves()
+
+
+def test_grid_round_trip_and_transpose():
+    for grid in random_grids(100, seed=2):
+        board = bitboard.from_grid(grid)
+        assert bitboard.to_grid(board) == grid
+        assert bitboard.to_grid(bitboard.transpose(board)) == [list(column) for column in zip(*grid)]
+        assert bitboard.transpose(bitboard.transpose(board)) == board
+        assert bitboard.count_empty(board) == sum(row.count(0) for row in grid)
+        assert bitboard.tile_sum(board) == sum(map(sum, grid))
+
+
+def test_largest_tiles_do_not_merge():
+    board = bitboard.from_grid([[32768, 32768, 0, 0], [0] * 4, [0] * 4, [0] * 4])
+    assert bitboard.move(board, "left") == (board, 0)
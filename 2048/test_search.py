@@ -0,0 +1,23 @@
+from game import Game2048AI, PackedGame2048
+
+
+def test_cached_values_cut_short_are_not_reused_for_likelier_visits():
+    game = PackedGame2048(4, seed=1)
+    ai = Game2048AI(game, min_probability=0.01)
+    board = ai.get_board()
+    ai.expectimax_move(board, 3, 0.02)  # its children fall under min_probability
+    fresh = Game2048AI(game, min_probability=0.01)
+    assert ai.expectimax_move(board, 3, 1.0) == fresh.expectimax_move(board, 3, 1.0)
+    assert ai.cache[(board, 3)][1] == 1.0
+
+
+def test_cache_evicts_the_least_recently_used_entry():
+    game = PackedGame2048(4, seed=2)
+    ai = Game2048AI(game, cache_size=2)
+    board = ai.get_board()
+    boards = [board] + [ai.engine.move(board, move)[0] for move in ai.get_possible_moves()][:2]
+    ai.expectimax_move(boards[0], 1, 1.0)
+    ai.expectimax_move(boards[1], 1, 1.0)
+    ai.expectimax_move(boards[0], 1, 1.0)  # a hit, now the most recently used
+    ai.expectimax_move(boards[2], 1, 1.0)
+    assert list(ai.cache) == [(boards[0], 1), (boards[2], 1)]
@@ -1,105 +1,247 @@
-import os
-import pickle
+import queue
+import random
+import re
+import threading
+import uuid
+from contextlib import contextmanager
 from copy import deepcopy
-from flask import Flask, jsonify, request
+from flask import Flask, Response, abort, jsonify, request
 from flask_cors import CORS
 
 from catan import BoardUtils, EndpointHelpers, ExampleBoards
+from events import Broadcaster, format_event
+from mcts import POOL_WORKERS, MCTSBot
+from simulate import apply_action
+from store import GameNotFound, GameStore
 
 
 app = Flask(__name__)
 CORS(app)
 
-os.makedirs('games', exist_ok=True)
-GAME_STATE_FILE = 'games/game_state1.pkl'
+GAME_ID = 'game_state1' # game of the /api/... routes without a game id, saved as games/game_state1.pkl
+GAME_ID_PATTERN = re.compile(r'[A-Za-z0-9_-]{1,64}') # game ids are file names
+AI_BOTS = {} # {game_id: {player_id: MCTSBot}}, kept so each bot reuses its search tree, dropped with the game's board
+STORE = GameStore('games', on_evict=lambda game_id: AI_BOTS.pop(game_id, None)) # boards live in memory, saved to disk in the background
+EVENTS = Broadcaster() # pushes every game's changes to its /events streams
+KEEPALIVE_SECONDS = 15 # comment lines sent on quiet streams, so proxies don't close them
+MAX_AI_ITERATIONS = 5000 # per decision, larger ai-turn requests are clamped to these
+MAX_AI_TIME_BUDGET_MS = 5000
+MAX_AI_WORKERS = POOL_WORKERS + 1
+MAX_AI_ACTIONS = 20 # decisions per AI turn
+AI_TURNS = set() # game ids with an AI turn in progress, one at a time per game
+AI_TURNS_LOCK = threading.Lock()
 
-def save_game_state(board):
-    """Save game state to pickle file"""
-    with open(GAME_STATE_FILE, 'wb') as f:
-        pickle.dump(board, f)
+def game_route(rule, **options):
+    """Registers a view under /api/games/<game_id>/rule and, for the default game, under /api/rule"""
+    def decorator(view):
+        app.route(f'/api/games/<game_id>/{rule}', **options)(view)
+        return app.route(f'/api/{rule}', defaults={'game_id': GAME_ID}, **options)(view)
+    return decorator
 
-def load_game_state():
-    """Load game state from pickle file"""
-    if os.path.exists(GAME_STATE_FILE):
-        with open(GAME_STATE_FILE, 'rb') as f:
-            return pickle.load(f)
-    
-    print('load_game_state | Setting up new game')
-    board = BoardUtils.setup_board()
-    # board = ExampleBoards.example_settlement_cutoff_board()
-    return board
-        
+@app.errorhandler(GameNotFound)
+def game_not_found(error):
+    return jsonify({'error': f'Unknown game {error.args[0]}, create one with POST /api/games'}), 404
+
+def can_create(game_id):
+    """Games are created by POST /api/games, only the default game comes into being when it is first used"""
+    return game_id == GAME_ID
+
+@app.url_value_preprocessor
+def check_game_id(endpoint, values):
+    if values and not GAME_ID_PATTERN.fullmatch(values.get('game_id', GAME_ID)):
+        abort(400, 'Invalid game id')
+
+def requested_players():
+    """Players to send next_actions for: ?players=1,3 or ?players=all, the current player if not given"""
+    players = request.args.get('players')
+    if players is None or players == 'all':
+        return players
+    return players.split(',')
+
+def wants_delta():
+    """?since=<version> asks for the changes since that version (Board.get_board_delta), ?since= for a full delta"""
+    return 'since' in request.args
 
-@app.route('/api/start-game', methods=['POST'])
-def start_game():
+def prev_state(board):
+    """The state before a change, only sent in full responses"""
+    return None if wants_delta() else board.get_board_state(get_next_actions=False)
+
+def board_response(board, prev_board=None, **fields):
+    """fields plus 'delta' with ?since, otherwise 'prev_board' (if given) and 'board' as full states"""
+    if wants_delta():
+        fields['delta'] = board.get_board_delta(request.args['since'], players=requested_players())
+    else:
+        if prev_board is not None:
+            fields['prev_board'] = prev_board
+        fields['board'] = board.get_board_state(players=requested_players())
+    return jsonify(fields)
+
+def publish(game_id, board, since):
+    """Sends the changes since a version to the game's streams, as a delta with 'since' added. Hold the game's lock."""
+    if EVENTS.has_subscribers(game_id):
+        delta = board.get_board_delta(since, players='all')
+        delta['since'] = since
+        EVENTS.publish(game_id, delta)
+
+@contextmanager
+def edit_game(game_id, create=None):
+    """STORE.edit that publishes the changes made to the board"""
+    with STORE.edit(game_id, can_create(game_id) if create is None else create) as board:
+        version = board.get_version()
+        yield board
+        if board.get_version() != version:
+            publish(game_id, board, version)
+
+
+@game_route('start-game', methods=['POST'])
+def start_game(game_id):
     """Initialize a new game"""
-    board = load_game_state()
-    save_game_state(board)
-    return jsonify({'board': board.get_board_state()})
+    with edit_game(game_id) as board:
+        return board_response(board)
 
-@app.route('/api/board-state', methods=['GET'])
-def get_board_state():
-    board = load_game_state()
-    return jsonify({'board': board.get_board_state()})
+@game_route('board-state', methods=['GET'])
+def get_board_state(game_id):
+    with STORE.read(game_id, can_create(game_id)) as board:
+        return board_response(board)
 
-@app.route('/api/roll-dice', methods=['POST'])
-def roll_dice():
+@game_route('events', methods=['GET'])
+def game_events(game_id):
+    """
+    Server-sent event stream of the game's changes. The first event brings the client up to date from the Last-Event-ID
+    of a reconnecting EventSource, or else ?since=<version>, a full state if it has neither. Every change after that is sent
+    as a delta with 'since', the version it applies to. next_actions are for all players.
+    """
+    # A reconnecting EventSource sends the version it last saw as Last-Event-ID, its URL still has the ?since= it opened with
+    since = request.headers.get('Last-Event-ID') or request.args.get('since')
+    with STORE.read(game_id, can_create(game_id)) as board: # changes are published under the same lock, so none are missed or repeated
+        subscription = EVENTS.subscribe(game_id)
+        first = board.get_board_delta(since, players='all')
+        first['since'] = since
+
+    def stream():
+        try:
+            yield format_event(first, first['version'])
+            while True:
+                try:
+                    event = subscription.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                if event is None: # dropped for falling behind, the client reconnects and catches up
+                    return
+                yield format_event(event, event['version'])
+        finally:
+            EVENTS.unsubscribe(game_id, subscription)
+
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@game_route('roll-dice', methods=['POST'])
+def roll_dice(game_id):
     """Roll dice and collect resources"""
-    board = load_game_state()
-    output_board = EndpointHelpers.handle_roll_dice(board)
-    save_game_state(output_board)
-    return jsonify({'prev_board': board.get_board_state(get_next_actions=False), 'board': output_board.get_board_state()})
+    with edit_game(game_id) as board:
+        prev_board = prev_state(board)
+        result = EndpointHelpers.handle_roll_dice(board, board.current_player)
+        return board_response(board, prev_board, dice1=result['dice1'], dice2=result['dice2'])
 
 
-@app.route('/api/place-settlement', methods=['POST'])
-def place_settlement():
+@game_route('place-settlement', methods=['POST'])
+def place_settlement(game_id):
     """Place a settlement at the specified vertex""" 
     data = request.get_json()
     vertex_id = data.get('vertex_id')
     player_id = str(data.get('player_id'))
     
-    board = load_game_state()
-    output_board = EndpointHelpers.handle_place_settlement(board, vertex_id, player_id)
-    save_game_state(output_board)
-    return jsonify({'prev_board': board.get_board_state(get_next_actions=False), 'board': output_board.get_board_state()})
+    with edit_game(game_id) as board:
+        prev_board = prev_state(board) # handlers change the board in place
+        output_board = EndpointHelpers.handle_place_settlement(board, vertex_id, player_id)
+        return board_response(output_board, prev_board)
 
-@app.route('/api/place-road', methods=['POST'])
-def place_road():
+@game_route('place-road', methods=['POST'])
+def place_road(game_id):
     """Place a road between two vertices"""
     data = request.get_json()
     start_vertex = data.get('start_vertex')
     end_vertex = data.get('end_vertex')
     player_id = str(data.get('player_id'))
 
-    board = load_game_state()
-    output_board = EndpointHelpers.handle_place_road(board, start_vertex, end_vertex, player_id)
-    save_game_state(output_board)
-    return jsonify({'prev_board': board.get_board_state(get_next_actions=False), 'board': output_board.get_board_state()})
+    with edit_game(game_id) as board:
+        prev_board = prev_state(board) # handlers change the board in place
+        output_board = EndpointHelpers.handle_place_road(board, start_vertex, end_vertex, player_id)
+        return board_response(output_board, prev_board)
     
 
-@app.route('/api/end-turn', methods=['POST'])
-def end_turn():
+@game_route('end-turn', methods=['POST'])
+def end_turn(game_id):
     """End current player's turn and move to next player"""
-    board = load_game_state()
-    output_board = EndpointHelpers.handle_end_turn(board)
-    save_game_state(output_board)
-    return jsonify({'prev_board': board.get_board_state(get_next_actions=False), 'board': output_board.get_board_state()})
+    with edit_game(game_id) as board:
+        prev_board = prev_state(board) # handlers change the board in place
+        output_board = EndpointHelpers.handle_end_turn(board)
+        return board_response(output_board, prev_board)
 
-@app.route("/api/build-city", methods=['POST'])
-def build_city():
+@game_route('build-city', methods=['POST'])
+def build_city(game_id):
     """Upgrade a settlement to a city at the specified vertex"""
    
     data = request.get_json()
     vertex_id = data.get('vertex_id')
     player_id = str(data.get('player_id'))
 
-    board = load_game_state()
-    output_board = EndpointHelpers.handle_build_city(board, vertex_id, player_id)
-    save_game_state(output_board)
-    return jsonify({'prev_board': board.get_board_state(get_next_actions=False), 'board': output_board.get_board_state()})
+    with edit_game(game_id) as board:
+        prev_board = prev_state(board) # handlers change the board in place
+        output_board = EndpointHelpers.handle_build_city(board, vertex_id, player_id)
+        return board_response(output_board, prev_board)
+
+def ai_option(data, name, default, maximum):
+    """A positive number from the ai-turn JSON, clamped to the server's maximum"""
+    value = data.get(name, default)
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+        abort(400, f'{name} must be a positive number')
+    return max(1, min(int(value), maximum))
+
+@game_route('ai-turn', methods=['POST'])
+def ai_turn(game_id):
+    """Plays the current player's whole turn with the MCTS bot: roll, builds, end turn
 
-@app.route('/api/reset-board', methods=['POST'])
-def reset_board():
+    Optional JSON: iterations (per decision), time_budget_ms (per decision), workers (search processes),
+    clamped to MAX_AI_ITERATIONS, MAX_AI_TIME_BUDGET_MS and MAX_AI_WORKERS. The bot searches a copy of the
+    board without holding the game's lock, so the game can be read meanwhile. If it is changed by another
+    request, the AI turn stops there with a 409.
+    """
+    data = request.get_json(silent=True) or {}
+    iterations = ai_option(data, 'iterations', 200, MAX_AI_ITERATIONS)
+    time_budget_ms = ai_option(data, 'time_budget_ms', 2000, MAX_AI_TIME_BUDGET_MS)
+    workers = ai_option(data, 'workers', 1, MAX_AI_WORKERS)
+    with AI_TURNS_LOCK:
+        if game_id in AI_TURNS:
+            return jsonify({'error': f'An AI turn is already being played in game {game_id}'}), 409
+        AI_TURNS.add(game_id)
+    try:
+        with edit_game(game_id) as board:
+            prev_board = prev_state(board)
+            player_id = board.current_player
+            roll = EndpointHelpers.handle_roll_dice(board, player_id)
+            version, position = board.get_version(), board.clone()
+
+        bot = AI_BOTS.setdefault(game_id, {}).setdefault(player_id, MCTSBot())
+        bot.iterations, bot.time_budget_ms, bot.workers = iterations, time_budget_ms, workers
+        actions = []
+        while True:
+            action = bot.choose_action(position, player_id) if len(actions) < MAX_AI_ACTIONS else None
+            with edit_game(game_id) as board:
+                if board.get_version() != version:
+                    return jsonify({'error': 'The game changed during the AI turn', 'actions': actions}), 409
+                if action is None:
+                    output_board = EndpointHelpers.handle_end_turn(board)
+                    return board_response(output_board, prev_board, dice1=roll['dice1'], dice2=roll['dice2'], actions=actions)
+                apply_action(board, player_id, action)
+                actions.append(action)
+                version, position = board.get_version(), board.clone()
+    finally:
+        with AI_TURNS_LOCK:
+            AI_TURNS.discard(game_id)
+
+@game_route('reset-board', methods=['POST'])
+def reset_board(game_id):
     """Reset the game board to initial state
     
     Accepts board_type parameter:
@@ -115,10 +257,24 @@ def reset_board():
     elif board_type == 'highest_production':
         board = ExampleBoards.example_highest_production_first_spots()
     else:  # default
-        board = BoardUtils.setup_board()
+        board = BoardUtils.setup_board(random.getrandbits(64)) # seeded, so its log can start from the seed
         
-    save_game_state(board)
-    return jsonify({'board': board.get_board_state()})
+    STORE.put(game_id, board, can_create(game_id))
+    AI_BOTS.pop(game_id, None) # their search trees are for the old board
+    with STORE.read(game_id, can_create(game_id)) as board:
+        publish(game_id, board, None) # a new board, so a full state
+        return board_response(board)
+
+@app.route('/api/games', methods=['GET'])
+def list_games():
+    return jsonify({'games': STORE.game_ids()})
+
+@app.route('/api/games', methods=['POST'])
+def create_game():
+    """Sets up a new game under a fresh id, use it in /api/games/<game_id>/..."""
+    game_id = uuid.uuid4().hex[:12]
+    with edit_game(game_id, create=True) as board:
+        return board_response(board, game_id=game_id)
 
 if __name__ == "__main__":
     app.run(debug=True) 
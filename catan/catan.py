@@ -2,7 +2,11 @@ import json
 import math
 import random
 import tkinter as tk
-from enum import Enum
+import uuid
+from array import array
+from collections import deque
+from enum import Enum, IntEnum
+from functools import lru_cache
 from itertools import pairwise
 
 def visualization_catan_board(board_state, sf=30.0):
@@ -84,42 +88,129 @@ def visualization_catan_board(board_state, sf=30.0):
 
     root.mainloop()
 
-def generate_hex_grid():
-    hex_cells = []
-    vertex_cells = []
+HEX_DIRECTIONS = [(1, 0), (0, 1), (-1, 0), (0, -1), (1, -1), (-1, 1)]
+
 
+class BoardTopology:
+    """
+    Static shape of the board: coordinates, adjacency and edges.
+    The shape never changes, so it is computed once (TOPOLOGY) and shared by every Board.
+    Everything is a tuple indexed by unique_id (vertices 0-53, hexes 54-72).
+    """
     hex_radius = 5
-    for q in range(-hex_radius, hex_radius+1):
-        for r in range(max(-hex_radius, -q - hex_radius), min(hex_radius, -q + hex_radius)+1):
-            if (q-r) % 3 == 0 and (2*q + r) % 3 == 0: # hex point
-                hex_cells.append(HexCell(q, r))
-            else:
-                vertex_cells.append(VertexCell(q, r))
-
-    hex_cells = [h for h in hex_cells if len([v for v in vertex_cells if v.is_neighbor(h)]) == 6]
-    vertex_cells = [v for v in vertex_cells if len([h for h in hex_cells if h.is_neighbor(v)]) != 0]
-    for i, node in enumerate(vertex_cells + hex_cells):
-        node.unique_id = i
-
-    for i, vertex in enumerate(vertex_cells): # calculating these once at board creation.
-        vertex.neighbor_vertexes = sorted([v.unique_id for v in vertex_cells if is_neighbor(vertex, v)])
-        vertex.neighbor_hexes = sorted([h.unique_id for h in hex_cells if h.is_neighbor(vertex)])
-
-    for hex_cell in hex_cells:
-        neighbor_hexes = []
-        vertex_neighbors = [v for v in vertex_cells if v.is_neighbor(hex_cell)]
-        for vertex_neighbor in vertex_neighbors:
-            neighbour_hexes = [h for h in hex_cells if h.is_neighbor(vertex_neighbor)]
-            neighbor_hexes.extend(neighbour_hexes)
-        hex_cell.neighbor_hexes = sorted(list(set([h.unique_id for h in neighbor_hexes if h.unique_id != hex_cell.unique_id])))
-        hex_cell.neighbor_vertexes = sorted(list(set([v.unique_id for v in vertex_cells if v.is_neighbor(hex_cell)])))
-
-    hex_cells_dict = {h.unique_id: h for h in hex_cells}
-    vertex_cells_dict = {v.unique_id: v for v in vertex_cells}
+
+    def __init__(self):
+        hex_points, vertex_points = [], []
+        for q in range(-self.hex_radius, self.hex_radius+1):
+            for r in range(max(-self.hex_radius, -q - self.hex_radius), min(self.hex_radius, -q + self.hex_radius)+1):
+                if (q-r) % 3 == 0 and (2*q + r) % 3 == 0: # hex point
+                    hex_points.append((q, r))
+                else:
+                    vertex_points.append((q, r))
+
+        def touching(point, points): # Same test as Cell.is_neighbor, by coordinate lookup
+            q, r = point
+            return [(q+dq, r+dr) for dq in (-1, 0, 1) for dr in (-1, 0, 1) if (dq or dr) and (q+dq, r+dr) in points]
+
+        vertex_set = set(vertex_points)
+        hex_points = [h for h in hex_points if len(touching(h, vertex_set)) == 6]
+        hex_set = set(hex_points)
+        vertex_points = [v for v in vertex_points if touching(v, hex_set)]
+        vertex_set = set(vertex_points)
+
+        self.coords = tuple(vertex_points + hex_points) # (q, r) by unique_id
+        self.coord_ids = {coord: i for i, coord in enumerate(self.coords)}
+        self.vertex_ids = tuple(range(len(vertex_points)))
+        self.hex_ids = tuple(range(len(vertex_points), len(self.coords)))
+
+        neighbor_vertexes, neighbor_hexes = [], []
+        for q, r in vertex_points:
+            neighbor_vertexes.append(tuple(sorted(self.coord_ids[(q+dq, r+dr)] for dq, dr in HEX_DIRECTIONS if (q+dq, r+dr) in vertex_set)))
+            neighbor_hexes.append(tuple(sorted(self.coord_ids[h] for h in touching((q, r), hex_set))))
+        for hex_id, point in zip(self.hex_ids, hex_points):
+            vertexes = sorted(self.coord_ids[v] for v in touching(point, vertex_set))
+            hexes = {h for v in vertexes for h in neighbor_hexes[v] if h != hex_id}  # really 2 nodes away on graph.
+            neighbor_vertexes.append(tuple(vertexes))
+            neighbor_hexes.append(tuple(sorted(hexes)))
+        self.neighbor_vertexes = tuple(neighbor_vertexes)
+        self.neighbor_hexes = tuple(neighbor_hexes)
+
+        # Edges (road spots) with stable ids, always stored as (smaller vertex id, larger vertex id)
+        self.edges = tuple((v1, v2) for v1 in self.vertex_ids for v2 in self.neighbor_vertexes[v1] if v1 < v2)
+        self.edge_ids = {edge: i for i, edge in enumerate(self.edges)}
+        self.vertex_edges = tuple(
+            tuple(self.edge_ids[(min(v1, v2), max(v1, v2))] for v2 in self.neighbor_vertexes[v1])
+            for v1 in self.vertex_ids
+        )
+
+        # Bitmasks for set algebra on vertex ids (and edge ids for roads)
+        self.all_vertices_mask = (1 << len(self.vertex_ids)) - 1
+        self.neighbor_vertex_masks = tuple(sum(1 << v2 for v2 in self.neighbor_vertexes[v1]) for v1 in self.vertex_ids)
+        self.vertex_edge_masks = tuple(sum(1 << e for e in edges) for edges in self.vertex_edges)
+
+    def __reduce__(self):
+        return 'TOPOLOGY' # pickled by reference, never copied into saved boards
+
+
+TOPOLOGY = BoardTopology()
+
+
+def iter_bits(mask):
+    """Positions of the set bits of mask, lowest first"""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def generate_hex_grid():
+    """Creates the mutable cells of a new board, adjacency comes from TOPOLOGY"""
+    vertex_cells_dict = {}
+    for vertex_id in TOPOLOGY.vertex_ids:
+        vertex = VertexCell(*TOPOLOGY.coords[vertex_id])
+        vertex.unique_id = vertex_id
+        vertex_cells_dict[vertex_id] = vertex
+
+    hex_cells_dict = {}
+    for hex_id in TOPOLOGY.hex_ids:
+        hex_cell = HexCell(*TOPOLOGY.coords[hex_id])
+        hex_cell.unique_id = hex_id
+        hex_cells_dict[hex_id] = hex_cell
     return hex_cells_dict, vertex_cells_dict
 
 
+class ChangeLog:
+    """
+    What the last maxlen touch() calls of a board changed, for Board.get_board_delta: (version, part, key) with part a
+    get_board_state key ('vertex_cells' and 'roads' with the vertex id or (v1, v2) key, 'hexes', 'resources' for bank
+    and players, 'current_player') or None when anything may have changed.
+    """
+    def __init__(self, version, maxlen=512):
+        self.id = uuid.uuid4().hex[:8] # versions of another board (replaced or reloaded) don't match this one's
+        self.start = version # the board version when logging started
+        self.entries = deque(maxlen=maxlen)
+
+    def version(self, board_version):
+        """Version string sent to clients"""
+        return f'{self.id}.{board_version}'
+
+    def since(self, version):
+        """Entries after a version string, None if it is not one of this log's or too old to have all of them"""
+        log_id, _, number = (version or '').partition('.')
+        if log_id != self.id or not number.isdigit():
+            return None
+        number = int(number)
+        # Entries are dropped from the left, so a version may have lost some of its entries
+        oldest = self.entries[0][0] if len(self.entries) == self.entries.maxlen else self.start
+        if number < oldest:
+            return None
+        entries = [entry for entry in self.entries if entry[0] > number]
+        return None if any(part is None for _, part, _ in entries) else entries
+
+
 class Board:
+    topology = TOPOLOGY
+
     def __init__(self):
         self.hex_cells = {}
         self.vertex_cells = {}
@@ -127,41 +218,252 @@ class Board:
         # Convert player IDs to strings
         self.players = {str(id): Player(str(id)) for id in range(1, 5)}
         self.current_player = '1'
+        self.seed = None # setup_board seed, if the layout came from one
+        self.index = None # BoardIndex, built on first use by get_index()
+        self.version = 0 # bumped by touch() on every change
+        self.next_actions_cache = {} # {player_id: (version, actions)}
+        self.log = None # if a list, (player_id, action) of every apply() and dice roll is appended to it (see store.py)
+        self.changes = None # ChangeLog, started by the first get_version or get_board_delta
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['index'] = None # rebuilt from the cells after loading
+        state['next_actions_cache'] = {}
+        state['log'] = None
+        state['changes'] = None
+        return state
+
+    def __setstate__(self, state):
+        # Older pickles have none of these
+        state.setdefault('seed', None)
+        state.setdefault('index', None)
+        state.setdefault('version', 0)
+        state.setdefault('next_actions_cache', {})
+        state.setdefault('log', None)
+        state.setdefault('changes', None)
+        self.__dict__.update(state)
+
+    def touch(self, part=None, key=None):
+        """
+        Call after changing buildings, roads, resources or the current player, so memoized results are recomputed.
+        part and key say what changed for get_board_delta (see ChangeLog), leave them out when it could be anything.
+        """
+        self.version += 1
+        if self.changes is not None:
+            self.changes.entries.append((self.version, part, key))
+
+    def get_next_actions(self, player_id):
+        """BoardUtils.possible_next_actions, memoized until the board changes. Don't modify the result."""
+        cached = self.next_actions_cache.get(player_id)
+        if cached is None or cached[0] != self.version:
+            cached = (self.version, BoardUtils.possible_next_actions(self, player_id))
+            self.next_actions_cache[player_id] = cached
+        return cached[1]
+
+    def get_index(self):
+        if self.index is None:
+            self.index = BoardIndex(self)
+        return self.index
+
+    # Buildings and roads should only be changed through these, so the index stays in sync with the cells
+    def place_settlement(self, vertex_id, player_id):
+        vertex = self.vertex_cells[vertex_id]
+        vertex.owner_id = player_id
+        vertex.building = BuildingType.settlement
+        if self.index is not None:
+            self.index.add_settlement(self, vertex_id, player_id)
+        self.touch('vertex_cells', vertex_id)
+
+    def build_city(self, vertex_id):
+        vertex = self.vertex_cells[vertex_id]
+        vertex.building = BuildingType.city
+        if self.index is not None:
+            self.index.add_city(self, vertex_id, vertex.owner_id)
+        self.touch('vertex_cells', vertex_id)
+
+    def place_road(self, vertex_id1, vertex_id2, player_id):
+        self.vertex_cells[vertex_id1].roads[vertex_id2] = player_id
+        self.vertex_cells[vertex_id2].roads[vertex_id1] = player_id
+        if self.index is not None:
+            self.index.add_road(self, vertex_id1, vertex_id2, player_id)
+        self.touch('roads', (min(vertex_id1, vertex_id2), max(vertex_id1, vertex_id2)))
+
+    def move_robber(self, hex_id):
+        old_hex_id = next((h.unique_id for h in self.hex_cells.values() if h.robber), None)
+        if old_hex_id is not None:
+            self.hex_cells[old_hex_id].robber = False
+        self.hex_cells[hex_id].robber = True
+        if self.index is not None:
+            self.index.move_robber(self, old_hex_id, hex_id)
+        self.touch('hexes')
+
+    def clone(self):
+        """Copy of the mutable state only (buildings, roads, robber, resources, turn and index), much cheaper than deepcopy"""
+        board = self.__class__.__new__(self.__class__)
+        board.hex_cells = {hex_id: hex_cell.copy() for hex_id, hex_cell in self.hex_cells.items()}
+        board.vertex_cells = {vertex_id: vertex.copy() for vertex_id, vertex in self.vertex_cells.items()}
+        board.bank = self.bank.copy()
+        board.players = {player_id: player.copy() for player_id, player in self.players.items()}
+        board.current_player = self.current_player
+        board.seed = self.seed
+        board.index = self.index.copy() if self.index is not None else None
+        board.version = self.version
+        board.next_actions_cache = dict(self.next_actions_cache)
+        board.log = None # clones are for trying actions out, not for recording them
+        board.changes = None
+        return board
 
-    def get_board_state(self, get_next_actions=True):
+    def get_resource_counts(self):
+        """Every player's and the bank's resources as a tuple of tuples, see set_resource_counts"""
+        return tuple(tuple(player.resources.values()) for player in self.players.values()) + (tuple(self.bank.resources.values()),)
+
+    def set_resource_counts(self, counts):
+        for resources, values in zip([p.resources for p in self.players.values()] + [self.bank.resources], counts):
+            for resource_type, value in zip(list(resources), values):
+                resources[resource_type] = value
+
+    def pay(self, player_id, cost):
+        """Moves the resources of cost ({ResourceType: count}) from the player to the bank"""
+        player = self.players[player_id]
+        for resource_type, count in cost.items():
+            player.resources[resource_type] -= count
+            self.bank.resources[resource_type] += count
+        self.touch('resources')
+
+    def apply(self, player_id, action):
+        """
+        Plays an action for a player and returns an undo record for undo(). The action is not checked, take it from
+        get_next_actions. Actions are (name, target):
+            ('settlement', vertex_id), ('city', vertex_id), ('roads', (vertex_id1, vertex_id2)) - paid from BUILD_COSTS
+            ('roll', dice_sum) - collects resources without printing
+            ('end_turn', None)
+        Records only hold what the action can change, so undo is O(1). Undo them last in, first out.
+        Undone actions stay in self.log, don't undo on a board that records one.
+        """
+        name, target = action
+        record = (action, self.current_player, self.get_resource_counts(), self.get_index().snapshot())
+        if name in BUILD_COSTS:
+            self.pay(player_id, BUILD_COSTS[name])
+        if name == BuildingType.settlement.name:
+            self.place_settlement(target, player_id)
+        elif name == BuildingType.city.name:
+            self.build_city(target)
+        elif name == 'roads':
+            self.place_road(target[0], target[1], player_id)
+        elif name == 'roll':
+            BoardUtils.collect_resources(self, target, player_id, verbose=False)
+        elif name == 'end_turn':
+            self.current_player = str(int(self.current_player) % 4 + 1)
+            self.touch('current_player')
+        else:
+            raise ValueError(f'Unknown action: {name}')
+        self.record(player_id, action)
+        return record
+
+    def record(self, player_id, action):
+        """Adds an action to self.log, replaying the log with apply() from the same start gives the same board"""
+        if self.log is not None:
+            self.log.append((player_id, action))
+
+    def undo(self, record):
+        """Reverts the action that returned record"""
+        (name, target), current_player, resource_counts, index_snapshot = record
+        if name == BuildingType.settlement.name:
+            vertex = self.vertex_cells[target]
+            vertex.owner_id = None
+            vertex.building = None
+        elif name == BuildingType.city.name:
+            self.vertex_cells[target].building = BuildingType.settlement
+        elif name == 'roads':
+            del self.vertex_cells[target[0]].roads[target[1]]
+            del self.vertex_cells[target[1]].roads[target[0]]
+        self.current_player = current_player
+        self.set_resource_counts(resource_counts)
+        self.index.restore(index_snapshot)
+        self.touch() # a new version rather than the old one, so memoized results from the undone branch are not reused
+
+    def get_board_state(self, get_next_actions=True, players=None):
+        """players: ids to include next_actions for, the current player by default or 'all'"""
         roads = []
         for vertex_cell in self.vertex_cells.values():
             for other_vertex_id, owner_id in vertex_cell.roads.items():
                 roads.append((min(vertex_cell.unique_id, other_vertex_id), max(vertex_cell.unique_id, other_vertex_id), owner_id))
         roads = list(set(roads))
 
-        if get_next_actions:
-            # next_actions = {self.current_player: BoardUtils.possible_next_actions(self, self.current_player)}
-            next_actions = {id: BoardUtils.possible_next_actions(self, id) for id in self.players.keys()}
-        else:
-            next_actions = {}
-
         return {
             'current_player': self.current_player,
-            'hexes': [{
-                'q': hex_cell.q,
-                'r': hex_cell.r,
-                'resource_type': hex_cell.resource_type.name,
-                'resource_number': hex_cell.resource_number,
-                'robber': hex_cell.robber
-            } for hex_cell in self.hex_cells.values()],
-            'vertex_cells': [{
-                'q': vertex_cell.q,
-                'r': vertex_cell.r,
-                'unique_id': vertex_cell.unique_id,
-                'owner_id': vertex_cell.owner_id,
-                'building': vertex_cell.building.name if vertex_cell.building else None
-            } for vertex_cell in self.vertex_cells.values()],
+            'hexes': self.hex_states(),
+            'vertex_cells': [self.vertex_state(vertex_id) for vertex_id in self.vertex_cells],
             'roads': roads,
             'bank': {k.name: v for k, v in self.bank.resources.items()},
             'players': {id: {k.name: v for k, v in player.resources.items()} for id, player in self.players.items()},
-            'next_actions': next_actions
+            'next_actions': self.next_actions_state(get_next_actions, players)
         }
+
+    def hex_states(self):
+        return [{
+            'q': hex_cell.q,
+            'r': hex_cell.r,
+            'resource_type': hex_cell.resource_type.name,
+            'resource_number': hex_cell.resource_number,
+            'robber': hex_cell.robber
+        } for hex_cell in self.hex_cells.values()]
+
+    def vertex_state(self, vertex_id):
+        vertex_cell = self.vertex_cells[vertex_id]
+        return {
+            'q': vertex_cell.q,
+            'r': vertex_cell.r,
+            'unique_id': vertex_cell.unique_id,
+            'owner_id': vertex_cell.owner_id,
+            'building': vertex_cell.building.name if vertex_cell.building else None
+        }
+
+    def next_actions_state(self, get_next_actions=True, players=None):
+        if not get_next_actions:
+            return {}
+        if players is None:
+            return {self.current_player: self.get_next_actions(self.current_player)}
+        players = self.players.keys() if players == 'all' else players
+        return {id: self.get_next_actions(id) for id in players}
+
+    def get_version(self):
+        """Version string of the current state for get_board_delta, starts the ChangeLog"""
+        if self.changes is None:
+            self.changes = ChangeLog(self.version)
+        return self.changes.version(self.version)
+
+    def get_board_delta(self, since=None, get_next_actions=True, players=None):
+        """
+        The board state as changes since a version from an earlier get_board_delta. Always has 'version' (send it as
+        since next time), 'full', 'current_player' and 'next_actions'. If since is unknown or too old, 'full' is True
+        and the rest is get_board_state. Otherwise only what changed: 'vertex_cells' and 'roads' list the changed
+        ones, and 'hexes', 'bank' and 'players' are only there if they changed.
+        """
+        version = self.get_version()
+        entries = self.changes.since(since)
+        if entries is None:
+            state = self.get_board_state(get_next_actions, players)
+            state.update(version=version, full=True)
+            return state
+
+        parts = {part for _, part, _ in entries}
+        delta = {
+            'version': version,
+            'full': False,
+            'current_player': self.current_player,
+            'vertex_cells': [self.vertex_state(vertex_id)
+                             for vertex_id in sorted({key for _, part, key in entries if part == 'vertex_cells'})],
+            'roads': [(v1, v2, self.vertex_cells[v1].roads[v2])
+                      for v1, v2 in sorted({key for _, part, key in entries if part == 'roads'})],
+            'next_actions': self.next_actions_state(get_next_actions, players)
+        }
+        if 'hexes' in parts:
+            delta['hexes'] = self.hex_states()
+        if 'resources' in parts:
+            delta['bank'] = {k.name: v for k, v in self.bank.resources.items()}
+            delta['players'] = {id: {k.name: v for k, v in player.resources.items()} for id, player in self.players.items()}
+        return delta
     
 
 
@@ -171,6 +473,21 @@ class Board:
 CellType = Enum('CellType', ['hex', 'vertex'])
 BuildingType = Enum('BuildingType', ['settlement', 'city'])
 ResourceType = Enum('ResourceType', ['wood', 'brick', 'wheat', 'sheep', 'ore', 'desert'])
+BuildingCode = IntEnum('BuildingCode', ['empty', 'settlement', 'city'], start=0) # BuildingType as small ints, 0 = no building
+RESOURCE_TYPES = [r for r in ResourceType if r != ResourceType.desert] # column order of resource arrays
+PIP_VALUES = { # dice combinations that roll each number, out of 36
+    -1 : 0, # 'desert'
+    2: 1, 12: 1,
+    3: 2, 11: 2,
+    4: 3, 10: 3,
+    5: 4, 9: 4,
+    6: 5, 8: 5
+}
+BUILD_COSTS = { # by action name, as in EndpointHelpers (a city needs 5 wheat to be offered but costs 2)
+    BuildingType.settlement.name: {ResourceType.wood: 1, ResourceType.brick: 1, ResourceType.wheat: 1, ResourceType.sheep: 1},
+    BuildingType.city.name: {ResourceType.wheat: 2, ResourceType.ore: 3},
+    'roads': {ResourceType.wood: 1, ResourceType.brick: 1},
+}
     
 class Player:
     def __init__(self, pid):
@@ -185,6 +502,12 @@ class Player:
         for k in self.resources.keys():
             self.resources[k] += 5
 
+    def copy(self):
+        player = Player.__new__(Player)
+        player.pid = self.pid
+        player.resources = dict(self.resources)
+        return player
+
 
 class Bank:
     def __init__(self):
@@ -196,6 +519,11 @@ class Bank:
             ResourceType.ore: 19
         }
 
+    def copy(self):
+        bank = Bank.__new__(Bank)
+        bank.resources = dict(self.resources)
+        return bank
+
 
 class Cell:
     def __init__(self, q, r, cell_type):
@@ -206,6 +534,25 @@ class Cell:
     def is_neighbor(self, cell):
         return abs(self.q - cell.q) <= 1 and abs(self.r - cell.r) <= 1
 
+    def copy(self):
+        cell = self.__class__.__new__(self.__class__)
+        cell.__dict__.update(self.__dict__)
+        return cell
+
+    @property
+    def neighbor_vertexes(self):
+        return TOPOLOGY.neighbor_vertexes[self.unique_id]
+
+    @property
+    def neighbor_hexes(self):
+        return TOPOLOGY.neighbor_hexes[self.unique_id]
+
+    def __setstate__(self, state):
+        # Older pickles stored neighbor lists on every cell, they now come from TOPOLOGY
+        state.pop('neighbor_vertexes', None)
+        state.pop('neighbor_hexes', None)
+        self.__dict__.update(state)
+
 
 class HexCell(Cell):
     def __init__(self, q, r, resource_type=None, resource_number=None):
@@ -214,7 +561,6 @@ class HexCell(Cell):
         self.resource_number = resource_number
         self.robber = False
         self.unique_id = None
-        self.neighbor_hexes = [] # really 2 nodes away on graph.
 
     def __repr__(self):
         return f'[{self.unique_id}] ({self.q}, {self.r}), resource_type: {self.resource_type}, resource_number: {self.resource_number}, robber: {self.robber}'
@@ -226,31 +572,289 @@ class VertexCell(Cell):
         self.owner_id = owner_id
         self.building = building
         self.unique_id = None
-        self.neighbor_vertexes = [] # neighbor vertex ids
-        self.neighbor_hexes = []
         self.roads = {} # dict of {other_vertex_id: owner_id, ...} # Note: this is duplicated for both vertices.
 
     def __repr__(self):
         return f'[{self.unique_id}] ({self.q}, {self.r}), building: {self.building}, owner_id: {self.owner_id}, roads: {self.roads}'
 
+    def copy(self):
+        cell = super().copy()
+        cell.roads = dict(self.roads)
+        return cell
+
 def is_neighbor(spot1, spot2):
-    diffs = [(1, 0), (0, 1), (-1, 0), (0, -1), (1, -1), (-1, 1)]
     diff = (spot1.q - spot2.q, spot1.r - spot2.r)
-    return diff in diffs
+    return diff in HEX_DIRECTIONS
+
+
+class CompactBoard:
+    """
+    Array-backed copy of a Board's mutable state, cheap to copy and pickle (e.g. for bots keeping many boards alive).
+    Player ids are ints 1-4 (0 = nobody), vertices and hexes are indexed by unique_id, roads by TOPOLOGY edge id,
+    and each player has bitmasks of their buildings (by vertex id) and roads (by edge id).
+    Convert with CompactBoard.from_board(board) and compact.to_board().
+    """
+    __slots__ = ('owners', 'buildings', 'road_owners', 'robber', 'hex_resources', 'hex_numbers',
+                 'resources', 'current_player', 'building_masks', 'road_masks')
+
+    BANK = 4 # row of the bank in resources, rows 0-3 are players 1-4
+
+    def __init__(self):
+        self.owners = bytearray(len(TOPOLOGY.vertex_ids))
+        self.buildings = bytearray(len(TOPOLOGY.vertex_ids)) # BuildingCode per vertex
+        self.road_owners = bytearray(len(TOPOLOGY.edges))
+        self.robber = None # hex id
+        self.hex_resources = bytes(len(TOPOLOGY.hex_ids)) # ResourceType.value by hex_id - first hex id, fixed for a game
+        self.hex_numbers = bytes(len(TOPOLOGY.hex_ids)) # 0 for the desert
+        self.resources = array('i', bytes(4 * 5 * len(RESOURCE_TYPES))) # 5 rows (players 1-4, bank) of RESOURCE_TYPES
+        self.current_player = 1
+        self.building_masks = [0] * 4
+        self.road_masks = [0] * 4
+
+    @classmethod
+    def from_board(cls, board):
+        compact = cls()
+        for vertex in board.vertex_cells.values():
+            if vertex.building is not None:
+                compact.set_building(vertex.unique_id, int(vertex.owner_id), BuildingCode[vertex.building.name])
+            for other_id, owner_id in vertex.roads.items():
+                if vertex.unique_id < other_id:
+                    compact.set_road(TOPOLOGY.edge_ids[(vertex.unique_id, other_id)], int(owner_id))
+
+        hex_cells = [board.hex_cells[hex_id] for hex_id in TOPOLOGY.hex_ids]
+        compact.hex_resources = bytes(h.resource_type.value for h in hex_cells)
+        compact.hex_numbers = bytes(max(h.resource_number, 0) for h in hex_cells)
+        compact.robber = next((h.unique_id for h in hex_cells if h.robber), None)
+
+        for row, resources in enumerate([p.resources for p in board.players.values()] + [board.bank.resources]):
+            for column, resource_type in enumerate(RESOURCE_TYPES):
+                compact.resources[row * len(RESOURCE_TYPES) + column] = resources[resource_type]
+        compact.current_player = int(board.current_player)
+        return compact
+
+    def to_board(self):
+        board = Board()
+        board.hex_cells, board.vertex_cells = generate_hex_grid()
+        first_hex = TOPOLOGY.hex_ids[0]
+        for hex_id, hex_cell in board.hex_cells.items():
+            hex_cell.resource_type = ResourceType(self.hex_resources[hex_id - first_hex])
+            hex_cell.resource_number = self.hex_numbers[hex_id - first_hex] or -1
+            hex_cell.robber = hex_id == self.robber
+
+        for vertex_id, owner in enumerate(self.owners):
+            if owner:
+                vertex = board.vertex_cells[vertex_id]
+                vertex.owner_id = str(owner)
+                vertex.building = BuildingType[BuildingCode(self.buildings[vertex_id]).name]
+        for edge_id, owner in enumerate(self.road_owners):
+            if owner:
+                v1, v2 = TOPOLOGY.edges[edge_id]
+                board.vertex_cells[v1].roads[v2] = str(owner)
+                board.vertex_cells[v2].roads[v1] = str(owner)
+
+        for row, resources in enumerate([p.resources for p in board.players.values()] + [board.bank.resources]):
+            for column, resource_type in enumerate(RESOURCE_TYPES):
+                resources[resource_type] = self.resources[row * len(RESOURCE_TYPES) + column]
+        board.current_player = str(self.current_player)
+        return board
+
+    def copy(self):
+        compact = CompactBoard.__new__(CompactBoard)
+        compact.owners = self.owners[:]
+        compact.buildings = self.buildings[:]
+        compact.road_owners = self.road_owners[:]
+        compact.robber = self.robber
+        compact.hex_resources = self.hex_resources # immutable bytes, shared
+        compact.hex_numbers = self.hex_numbers
+        compact.resources = self.resources[:]
+        compact.current_player = self.current_player
+        compact.building_masks = self.building_masks[:]
+        compact.road_masks = self.road_masks[:]
+        return compact
+
+    def set_building(self, vertex_id, player, building_code):
+        self.owners[vertex_id] = player
+        self.buildings[vertex_id] = building_code
+        self.building_masks[player - 1] |= 1 << vertex_id
+
+    def set_road(self, edge_id, player):
+        self.road_owners[edge_id] = player
+        self.road_masks[player - 1] |= 1 << edge_id
+
+    def get_resource(self, row, resource_type):
+        """row is 0-3 for players 1-4, CompactBoard.BANK for the bank"""
+        return self.resources[row * len(RESOURCE_TYPES) + RESOURCE_TYPES.index(resource_type)]
+
+    def get_board_state(self, get_next_actions=True, players=None):
+        """Same dict as Board.get_board_state, built from the arrays"""
+        first_hex = TOPOLOGY.hex_ids[0]
+        def resource_dict(row):
+            return {r.name: self.resources[row * len(RESOURCE_TYPES) + i] for i, r in enumerate(RESOURCE_TYPES)}
+
+        return {
+            'current_player': str(self.current_player),
+            'hexes': [{
+                'q': TOPOLOGY.coords[hex_id][0],
+                'r': TOPOLOGY.coords[hex_id][1],
+                'resource_type': ResourceType(self.hex_resources[hex_id - first_hex]).name,
+                'resource_number': self.hex_numbers[hex_id - first_hex] or -1,
+                'robber': hex_id == self.robber
+            } for hex_id in TOPOLOGY.hex_ids],
+            'vertex_cells': [{
+                'q': TOPOLOGY.coords[vertex_id][0],
+                'r': TOPOLOGY.coords[vertex_id][1],
+                'unique_id': vertex_id,
+                'owner_id': str(self.owners[vertex_id]) if self.owners[vertex_id] else None,
+                'building': BuildingCode(self.buildings[vertex_id]).name if self.buildings[vertex_id] else None
+            } for vertex_id in TOPOLOGY.vertex_ids],
+            'roads': [(*TOPOLOGY.edges[edge_id], str(owner)) for edge_id, owner in enumerate(self.road_owners) if owner],
+            'bank': resource_dict(self.BANK),
+            'players': {str(row + 1): resource_dict(row) for row in range(4)},
+            # Move generation lives on Board, so the actions come from a converted copy
+            'next_actions': self.to_board().get_board_state(players=players)['next_actions'] if get_next_actions else {}
+        }
+
+
+class BoardIndex:
+    """
+    Lookups for move generation, kept up to date by the Board mutators instead of scanning the board.
+    All are bitmasks over vertex ids, except roads which is over TOPOLOGY edge ids:
+        settlements, cities: {player_id: mask} of each player's buildings
+        networks: {player_id: mask} of vertices a player's next road can start from (their buildings and
+                  everything reachable along their own roads without passing an opponent's building)
+        occupied: vertices with a building
+        blocked: vertices where no settlement can go (occupied or next to a building)
+        roads: edges with a road
+    And for resource collection:
+        number_hexes: {dice number: [hex ids]}, fixed once the numbers are assigned
+        payouts: {dice number: {player_id: [(vertex_id, hex_id, resource_type, amount), ...]}} of every building
+                 next to a hex with that number and without the robber, in vertex id then hex id order
+    """
+    __slots__ = ('settlements', 'cities', 'networks', 'occupied', 'blocked', 'roads', 'number_hexes', 'payouts')
+
+    def __init__(self, board):
+        self.settlements = {player_id: 0 for player_id in board.players}
+        self.cities = {player_id: 0 for player_id in board.players}
+        self.occupied = self.blocked = self.roads = 0
+        for vertex in board.vertex_cells.values():
+            bit = 1 << vertex.unique_id
+            if vertex.building == BuildingType.settlement:
+                self.settlements[vertex.owner_id] |= bit
+            elif vertex.building == BuildingType.city:
+                self.cities[vertex.owner_id] |= bit
+            if vertex.building is not None:
+                self.occupied |= bit
+                self.blocked |= bit | TOPOLOGY.neighbor_vertex_masks[vertex.unique_id]
+            for other_id in vertex.roads:
+                if vertex.unique_id < other_id:
+                    self.roads |= 1 << TOPOLOGY.edge_ids[(vertex.unique_id, other_id)]
+        self.networks = {player_id: self.build_network(board, player_id) for player_id in board.players}
+
+        self.number_hexes = {}
+        for hex_cell in board.hex_cells.values():
+            if hex_cell.resource_number is not None and hex_cell.resource_number > 0:
+                self.number_hexes.setdefault(hex_cell.resource_number, []).append(hex_cell.unique_id)
+        self.payouts = {number: self.build_payouts(board, number) for number in self.number_hexes}
+
+    def snapshot(self):
+        """Everything a move can change, for restore(). The payout lists are replaced, never changed, so they are shared."""
+        return (dict(self.settlements), dict(self.cities), dict(self.networks), self.occupied, self.blocked, self.roads,
+                dict(self.payouts))
+
+    def restore(self, snapshot):
+        settlements, cities, networks, self.occupied, self.blocked, self.roads, payouts = snapshot
+        self.settlements, self.cities, self.networks, self.payouts = dict(settlements), dict(cities), dict(networks), dict(payouts)
+
+    def copy(self):
+        index = BoardIndex.__new__(BoardIndex)
+        index.number_hexes = self.number_hexes # fixed for a game
+        index.restore(self.snapshot())
+        return index
+
+    def buildings(self, player_id):
+        return self.settlements[player_id] | self.cities[player_id]
+
+    def build_network(self, board, player_id):
+        buildings = self.buildings(player_id)
+        return self.extend_network(board, player_id, buildings, list(iter_bits(buildings)))
+
+    def extend_network(self, board, player_id, network, frontier):
+        """Adds every vertex reachable from frontier along the player's roads to network"""
+        opponents = self.occupied & ~self.buildings(player_id)
+        while frontier:
+            vertex_id = frontier.pop()
+            for other_id, owner_id in board.vertex_cells[vertex_id].roads.items():
+                bit = 1 << other_id
+                if owner_id == player_id and not (network | opponents) & bit:
+                    network |= bit
+                    frontier.append(other_id)
+        return network
+
+    def build_payouts(self, board, number):
+        payouts = {player_id: [] for player_id in board.players}
+        for hex_id in self.number_hexes[number]:
+            hex_cell = board.hex_cells[hex_id]
+            if hex_cell.robber:
+                continue
+            for vertex_id in TOPOLOGY.neighbor_vertexes[hex_id]:
+                vertex = board.vertex_cells[vertex_id]
+                if vertex.building is not None:
+                    amount = 1 if vertex.building == BuildingType.settlement else 2
+                    payouts[vertex.owner_id].append((vertex_id, hex_id, hex_cell.resource_type, amount))
+        for entries in payouts.values():
+            entries.sort(key=lambda entry: entry[:2])
+        return payouts
+
+    def update_payouts(self, board, hex_ids):
+        """Rebuilds the payouts of the numbers on these hexes"""
+        numbers = {board.hex_cells[hex_id].resource_number for hex_id in hex_ids}
+        for number in numbers & self.payouts.keys():
+            self.payouts[number] = self.build_payouts(board, number)
+
+    def add_settlement(self, board, vertex_id, player_id):
+        bit = 1 << vertex_id
+        self.settlements[player_id] |= bit
+        self.occupied |= bit
+        self.blocked |= bit | TOPOLOGY.neighbor_vertex_masks[vertex_id]
+        self.networks[player_id] = self.extend_network(board, player_id, self.networks[player_id] | bit, [vertex_id])
+        for other_id, network in self.networks.items():
+            if other_id != player_id and network & bit: # cuts through an opponent's network
+                self.networks[other_id] = self.build_network(board, other_id)
+        self.update_payouts(board, TOPOLOGY.neighbor_hexes[vertex_id])
+
+    def add_city(self, board, vertex_id, player_id):
+        bit = 1 << vertex_id
+        self.settlements[player_id] &= ~bit
+        self.cities[player_id] |= bit
+        self.update_payouts(board, TOPOLOGY.neighbor_hexes[vertex_id])
+
+    def move_robber(self, board, old_hex_id, hex_id):
+        self.update_payouts(board, [h for h in (old_hex_id, hex_id) if h is not None])
+
+    def add_road(self, board, vertex_id1, vertex_id2, player_id):
+        self.roads |= 1 << TOPOLOGY.edge_ids[(min(vertex_id1, vertex_id2), max(vertex_id1, vertex_id2))]
+        network = self.networks[player_id]
+        opponents = self.occupied & ~self.buildings(player_id)
+        for start, end in ((vertex_id1, vertex_id2), (vertex_id2, vertex_id1)):
+            if network >> start & 1 and not (network | opponents) >> end & 1:
+                self.networks[player_id] = self.extend_network(board, player_id, network | 1 << end, [end])
 
 
 class BoardUtils:
     @staticmethod
-    def setup_board():
+    def setup_board(seed=None):
+        """seed makes the layout reproducible, otherwise it is drawn from the global random module"""
         board = Board()
         board.hex_cells, board.vertex_cells = generate_hex_grid()
 
-        BoardUtils.setup_resources(board)
-        BoardUtils.assign_valid_resource_numbers(board)
+        board.seed = seed
+        rng = random.Random(seed) if seed is not None else random
+        BoardUtils.setup_resources(board, rng)
+        BoardUtils.assign_valid_resource_numbers(board, rng=rng)
         return board
 
     @staticmethod
-    def setup_resources(board):
+    def setup_resources(board, rng=random):
         """Convert the old coordinate system to the new matrix-based one"""
         resources = [
             ResourceType.wood, ResourceType.wood, ResourceType.wood, ResourceType.wood,
@@ -260,7 +864,7 @@ class BoardUtils:
             ResourceType.sheep, ResourceType.sheep, ResourceType.sheep, ResourceType.sheep,
             ResourceType.desert
         ]
-        random.shuffle(resources)
+        rng.shuffle(resources)
 
         assert len(board.hex_cells) == len(resources), f'{len(board.hex_cells)} != {len(resources)}'
 
@@ -271,189 +875,143 @@ class BoardUtils:
 
 
     @staticmethod
-    def assign_valid_resource_numbers(board, max_attempts=1000):
+    @lru_cache(maxsize=None)
+    def independent_hex_sets(hex_ids, size=4):
+        """Every set of size hexes from hex_ids (a tuple) with no two of them adjacent, by backtracking"""
+        sets = []
+        def extend(chosen, start):
+            if len(chosen) == size:
+                sets.append(tuple(chosen))
+                return
+            for i in range(start, len(hex_ids)):
+                hex_id = hex_ids[i]
+                if not any(hex_id in TOPOLOGY.neighbor_hexes[other_id] for other_id in chosen):
+                    chosen.append(hex_id)
+                    extend(chosen, i + 1)
+                    chosen.pop()
+        extend([], 0)
+        return tuple(sets)
+
+    @staticmethod
+    def assign_valid_resource_numbers(board, seed=None, rng=None):
         """
         Phase 5: Assign dice roll values to non-desert tiles 
         so that no two '6' or '8' are adjacent.
+        The 6s and 8s go straight onto a set of non-adjacent hexes drawn from all such sets, then the other numbers
+        are shuffled onto the rest. Every valid layout is equally likely and there are no retries.
         """
-        resource_numbers = [2, 3, 3, 4, 4, 5, 5, 6, 6, 8, 8, 9, 9, 10, 10, 11, 11, 12]
+        rng = rng or (random.Random(seed) if seed is not None else random)
+        hot_numbers = [6, 6, 8, 8]
+        other_numbers = [2, 3, 3, 4, 4, 5, 5, 9, 9, 10, 10, 11, 11, 12]
         non_desert_hexes = [h for h in board.hex_cells.values() if h.resource_type != ResourceType.desert]
-        assert len(non_desert_hexes) == len(resource_numbers), f'{len(non_desert_hexes)} != {len(resource_numbers)}'
-
-        def invalid_distribution(board):
-            for h in board.hex_cells.values():
-                if h.resource_number in [6, 8]:
-                    for neighbor_id in h.neighbor_hexes:
-                        if board.hex_cells[neighbor_id].resource_number in [6, 8]:
-                            return True
-            return False
-        
+        assert len(non_desert_hexes) == len(hot_numbers) + len(other_numbers), f'{len(non_desert_hexes)} != {len(hot_numbers) + len(other_numbers)}'
+
         for tile in board.hex_cells.values(): # Deals with the edge case where the desert is left as None instead of -1
             tile.resource_number = -1
 
-        for attempt in range(1, max_attempts+1):
-            random.shuffle(resource_numbers)
-            for i, tile in enumerate(non_desert_hexes):
-                tile.resource_number = resource_numbers[i]
-            if not invalid_distribution(board):
-                print(f'Setting up resource numbers successfully after {attempt} attempts.')
-                return
-
-            print(f'Setting up resource numbers attempt {attempt} invalid, reseting and trying again.')
-            for tile in board.hex_cells.values(): # Otherwise reset and try again
-                tile.resource_number = -1
-        raise Exception(f"Could not create valid number distribution after {max_attempts} attempts")
+        # Each set of hot spots has the same number of ways to place the rest, so picking it uniformly keeps layouts uniform
+        hot_spot_sets = BoardUtils.independent_hex_sets(tuple(h.unique_id for h in non_desert_hexes), len(hot_numbers))
+        if not hot_spot_sets:
+            raise Exception("No valid number distribution: the 6s and 8s cannot be kept apart")
+        hot_spots = rng.choice(hot_spot_sets)
+        rng.shuffle(hot_numbers)
+        rng.shuffle(other_numbers)
+
+        for hex_id, number in zip(hot_spots, hot_numbers):
+            board.hex_cells[hex_id].resource_number = number
+        for tile, number in zip([h for h in non_desert_hexes if h.unique_id not in hot_spots], other_numbers):
+            tile.resource_number = number
     
     @staticmethod
     def valid_settlements(board):
-        starting_nodes = [v for v in board.vertex_cells.values() if v.building is None]
-
-        def is_valid_spot(possible_spot):
-            for neighbour_id in possible_spot.neighbor_vertexes:
-                neighbour = board.vertex_cells[neighbour_id]
-                if neighbour.building is not None:
-                    # print(f'{possible_spot.unique_id} ({possible_spot.q}, {possible_spot.r}) is not a valid spot because {neighbour_id} ({neighbour.q}, {neighbour.r}) is occupied.')
-                    return False
-            return True
-
-        valid_spots = []
-        for possible_spot in starting_nodes:
-            if is_valid_spot(possible_spot):
-                valid_spots.append(possible_spot.unique_id)
-        return valid_spots
+        """Empty vertices with no building next to them"""
+        return list(iter_bits(TOPOLOGY.all_vertices_mask & ~board.get_index().blocked))
 
     @staticmethod
     def valid_cities(board, owner_id):
         """Check user has resources before calling this function."""
-        buildings = [v for v in board.vertex_cells.values() if v.owner_id == owner_id]
-        settlements = [b for b in buildings if b.building == BuildingType.settlement]
-        if len(settlements) == 5:
+        index = board.get_index()
+        if index.settlements[owner_id].bit_count() == 5:
             print(f'{owner_id} has 5 settlements, so cannot build any more cities.')
             return []
         else:
-            return [b.unique_id for b in buildings if b.building == BuildingType.city]
+            return list(iter_bits(index.cities[owner_id]))
+
+    @staticmethod
+    def vertex_pips(board, vertex_id):
+        """Production of a spot: the pips of the numbers on its neighbouring hexes"""
+        return sum(PIP_VALUES[board.hex_cells[hex_id].resource_number] for hex_id in TOPOLOGY.neighbor_hexes[vertex_id])
 
     @staticmethod
     def highest_production_spot(board):
-        pip_values = {
-            -1 : 0, # 'desert'
-            2: 1, 12: 1,
-            3: 2, 11: 2,
-            4: 3, 10: 3,
-            5: 4, 9: 4,
-            6: 5, 8: 5
-        }
-        available_spots  = BoardUtils.valid_settlements(board)
-
-        vertex_pips = []
-        for vertex_id in available_spots:
-            vertex = board.vertex_cells[vertex_id]
-            neighbour_hexes =[board.hex_cells[hex_id] for hex_id in vertex.neighbor_hexes]
-            neighbour_pips = [pip_values[hex.resource_number] for hex in neighbour_hexes]
-            vertex_pips.append((sum(neighbour_pips), vertex_id))
-        vertex_pips.sort(key=lambda x: x[0], reverse=True)
-        return vertex_pips[0][1]
+        """Free spot with the most pips (lowest vertex id on ties), see placement.py for other objectives"""
+        from placement import DEFAULT_SCORER # imported here, placement.py builds on this module
+        return DEFAULT_SCORER.best_spot(board)
+
+    @staticmethod
+    def victory_points(board, player_id):
+        """1 per settlement, 2 per city"""
+        index = board.get_index()
+        return index.settlements[player_id].bit_count() + 2 * index.cities[player_id].bit_count()
     
     @staticmethod
-    def collect_resources(board, dice_roll, current_player_id="3"):
+    def collect_resources(board, dice_roll, current_player_id="3", verbose=True):
         player_order = []  # Wraps e.g. ["3", "4", "1", "2"]
         current = int(current_player_id)
         for i in range(4):  # 4 players total
             player_id = str(((current - 1 + i) % 4) + 1)
             player_order.append(player_id)
 
+        payouts = board.get_index().payouts.get(dice_roll, {})
         for player_id in player_order:
-            player_buildings = [v for v in board.vertex_cells.values() if v.owner_id == player_id]
-            for building in player_buildings:
-                for hex_id in building.neighbor_hexes:
-                    hex = board.hex_cells[hex_id]
-                    if hex.resource_number == dice_roll and not hex.robber:
-                        factor = 1 if building.building == BuildingType.settlement else 2
-                        if board.bank.resources[hex.resource_type] >= factor:
-                            board.players[player_id].resources[hex.resource_type] += factor
-                            board.bank.resources[hex.resource_type] -= factor
-                            print(f'Collected {factor} {hex.resource_type.name} from {hex_id} for player {player_id}')
-                        else:
-                            print(f'Player {player_id} does not have enough resources to collect {factor} {hex.resource_type}')
-                            if board.bank.resources[hex.resource_type] == 1:
-                                print(f'Given 1 out of 2 of {hex.resource_type} to {player_id}')
-                                board.players[player_id].resources[hex.resource_type] += 1
+            for _, hex_id, resource_type, factor in payouts.get(player_id, ()):
+                if board.bank.resources[resource_type] >= factor:
+                    board.players[player_id].resources[resource_type] += factor
+                    board.bank.resources[resource_type] -= factor
+                    if verbose:
+                        print(f'Collected {factor} {resource_type.name} from {hex_id} for player {player_id}')
+                else:
+                    if verbose:
+                        print(f'Player {player_id} does not have enough resources to collect {factor} {resource_type}')
+                    if board.bank.resources[resource_type] == 1:
+                        if verbose:
+                            print(f'Given 1 out of 2 of {resource_type} to {player_id}')
+                        board.players[player_id].resources[resource_type] += 1
+        board.touch('resources')
         return board
 
     @staticmethod
     def valid_origin_vertices(board, player_id):
         """
-        Finds all valid vertices where a player could build their next road from.
-        Uses BFS to explore all reachable vertices from each building.
-        
+        Finds all valid vertices where a player could build their next road from:
+        their buildings and everything connected to them by their roads, not passing an opponent's building.
+        Maintained incrementally by the board's index.
+
         Returns:
-            set: Vertex IDs that are valid starting points for new roads
+            list: Sorted vertex IDs that are valid starting points for new roads
         """
-        from collections import deque
-        
-        # Start with all building locations as valid origins
-        buildings = {v.unique_id for v in board.vertex_cells.values() 
-                    if v.owner_id == player_id and v.building is not None}
-        valid_origins = buildings.copy()
-        
-        # For each building, explore all connected paths
-        for building_id in buildings:
-            visited = {building_id}
-            queue = deque([building_id])
-            
-            while queue:
-                current_vertex_id = queue.popleft()
-                current_vertex = board.vertex_cells[current_vertex_id]
-                
-                # Check all roads from this vertex
-                for neighbor_id in current_vertex.roads:
-                    # Skip if we've already visited this vertex
-                    if neighbor_id in visited:
-                        continue
-                        
-                    neighbor = board.vertex_cells[neighbor_id]
-                    # Skip if blocked by opponent's building
-                    if neighbor.building is not None and neighbor.owner_id != player_id:
-                        continue
-                        
-                    # If this road belongs to the player, we can traverse it
-                    if current_vertex.roads[neighbor_id] == player_id:
-                        visited.add(neighbor_id)
-                        queue.append(neighbor_id)
-                        valid_origins.add(neighbor_id)
-        
-        return sorted(list(valid_origins))
+        return list(iter_bits(board.get_index().networks[player_id]))
     
     @staticmethod
     def possible_next_actions(board, player_id):
         actions = {'player_id' : player_id}
-        player_buildings = [v for v in board.vertex_cells.values() if v.owner_id == player_id]
-        cities = [b for b in player_buildings if b.building == BuildingType.city]
-        settlements = [b for b in player_buildings if b.building == BuildingType.settlement]
+        index = board.get_index()
+        settlements = index.settlements[player_id]
+        network = index.networks[player_id]
         resources = board.players[player_id].resources
-        if len(cities) < 5 and resources[ResourceType.ore] >= 3 and resources[ResourceType.wheat] >= 5:
-            actions[BuildingType.city.name] = [v.unique_id for v in settlements]
+        if index.cities[player_id].bit_count() < 5 and resources[ResourceType.ore] >= 3 and resources[ResourceType.wheat] >= 5:
+            actions[BuildingType.city.name] = list(iter_bits(settlements))
 
-        valid_vertices = BoardUtils.valid_origin_vertices(board, player_id)
-
-        if len(settlements) < 5 and (resources[ResourceType.wood] > 0 and resources[ResourceType.brick] > 0 
+        if settlements.bit_count() < 5 and (resources[ResourceType.wood] > 0 and resources[ResourceType.brick] > 0 
                         and resources[ResourceType.wheat] > 0 and resources[ResourceType.sheep] > 0):
-            all_valid_settlements = BoardUtils.valid_settlements(board)
-        
-            valid_settlement_spots = [v for v in all_valid_settlements if v in valid_vertices]
-            actions[BuildingType.settlement.name] = valid_settlement_spots
+            actions[BuildingType.settlement.name] = list(iter_bits(network & ~index.blocked))
 
         if resources[ResourceType.wood] > 0 and resources[ResourceType.brick] > 0:
-            possible_roads = []
-            for id in valid_vertices:
-                vertex = board.vertex_cells[id]
-
-                current_roads =  list(vertex.roads.keys())
-                for road_id in vertex.neighbor_vertexes:
-                    if road_id not in current_roads:
-                        possible_roads.append((min(id, road_id), max(id, road_id)))
-            possible_roads = sorted(list(set(possible_roads)))
-            actions['roads'] = possible_roads
+            road_edges = 0
+            for vertex_id in iter_bits(network):
+                road_edges |= TOPOLOGY.vertex_edge_masks[vertex_id]
+            # Edge ids are in (v1, v2) order, so the roads come out sorted
+            actions['roads'] = [TOPOLOGY.edges[edge_id] for edge_id in iter_bits(road_edges & ~index.roads)]
         return actions
 
 class EndpointHelpers:
@@ -465,10 +1023,10 @@ class EndpointHelpers:
         print(f'handle_roll_dice | Rolled dice: {dice1}, {dice2}')
         dice_sum = dice1 + dice2
         BoardUtils.collect_resources(board, dice_sum, current_player)
+        board.record(current_player, ('roll', dice_sum))
         return {
             'dice1': dice1,
             'dice2': dice2,
-            'board': board.get_board_state()
         }
 
     @staticmethod
@@ -482,18 +1040,11 @@ class EndpointHelpers:
         print(f'start_vertex: {start_vertex}, end_vertex: {end_vertex}')
         
         
-        possible_actions = BoardUtils.possible_next_actions(board, player_id)
+        possible_actions = board.get_next_actions(player_id)
         if 'roads' not in possible_actions or (start_vertex, end_vertex) not in possible_actions['roads']:
             raise ValueError('Invalid road placement')
         
-        board.vertex_cells[start_vertex].roads[end_vertex] = player_id
-        board.vertex_cells[end_vertex].roads[start_vertex] = player_id
-        
-        player = board.players[player_id]
-        player.resources[ResourceType.wood] -= 1
-        player.resources[ResourceType.brick] -= 1
-        board.bank.resources[ResourceType.wood] += 1
-        board.bank.resources[ResourceType.brick] += 1
+        board.apply(player_id, ('roads', (start_vertex, end_vertex)))
 
         return board
 
@@ -504,25 +1055,18 @@ class EndpointHelpers:
         current = int(board.current_player)
         new_player = str((current % 4) + 1)
         print(f'handle_end_turn called, old player: {board.current_player}, new player: {new_player}')
-        board.current_player = new_player
+        board.apply(board.current_player, ('end_turn', None))
         return board
 
     @staticmethod
     def handle_build_city(board, vertex_id, player_id):
         """Handle city building logic"""
         print(f'handle_build_city called with vertex_id: {vertex_id} and player_id: {player_id}')
-        possible_actions = BoardUtils.possible_next_actions(board, player_id)
+        possible_actions = board.get_next_actions(player_id)
         if BuildingType.city.name not in possible_actions or vertex_id not in possible_actions[BuildingType.city.name]:
             print(f'No city placement possible for player {player_id}')
             return board
-        vertex = board.vertex_cells[vertex_id]
-        vertex.building = BuildingType.city
-        
-        player = board.players[player_id]
-        player.resources[ResourceType.wheat] -= 2
-        player.resources[ResourceType.ore] -= 3
-        board.bank.resources[ResourceType.wheat] += 2
-        board.bank.resources[ResourceType.ore] += 3
+        board.apply(player_id, (BuildingType.city.name, vertex_id))
         return board
   
 
@@ -530,19 +1074,12 @@ class EndpointHelpers:
     def handle_place_settlement(board, vertex_id, player_id):
         """Handle settlement placement logic"""
         print(f'handle_place_settlement called with vertex_id: {vertex_id} and player_id: {player_id}')
-        possible_actions = BoardUtils.possible_next_actions(board, player_id)
+        possible_actions = board.get_next_actions(player_id)
         if BuildingType.settlement.name not in possible_actions or vertex_id not in possible_actions[BuildingType.settlement.name]:
             print(f'No settlement placement possible for player {player_id}')
             return board
         
-        vertex = board.vertex_cells[vertex_id]
-        vertex.owner_id = player_id
-        vertex.building = BuildingType.settlement
-        
-        player = board.players[player_id]
-        for resource_type in [ResourceType.wood, ResourceType.brick, ResourceType.wheat, ResourceType.sheep]:
-            player.resources[resource_type] -= 1
-            board.bank.resources[resource_type] += 1
+        board.apply(player_id, (BuildingType.settlement.name, vertex_id))
         return board
 
 class ExampleBoards:
@@ -552,28 +1089,15 @@ class ExampleBoards:
 
         ## Testing road length and settlment placement for road cut off
         # Player 1
-        vertex_cell = board.vertex_cells[32]
-        vertex_cell.owner_id = "1"
-        vertex_cell.building = BuildingType.settlement
-        vertex_cell.roads[38] = "1"
-        board.vertex_cells[38].roads[32] = "1"
-
-        board.vertex_cells[38].roads[37] = "1"
-        board.vertex_cells[37].roads[38] = "1"
-
-        board.vertex_cells[38].roads[44] = "1"
-        board.vertex_cells[44].roads[38] = "1"
-
-        vertex_cell = board.vertex_cells[37]
-        vertex_cell.owner_id = "1"
-        vertex_cell.building = BuildingType.settlement
+        board.place_settlement(32, "1")
+        board.place_road(32, 38, "1")
+        board.place_road(38, 37, "1")
+        board.place_road(38, 44, "1")
+        board.place_settlement(37, "1")
         #Player 2
-        vertex_cell = board.vertex_cells[25]
-        vertex_cell.owner_id = "2"
-        vertex_cell.building = BuildingType.settlement
+        board.place_settlement(25, "2")
         for start, end in pairwise([25, 31, 37, 43]):
-            board.vertex_cells[start].roads[end] = "2"
-            board.vertex_cells[end].roads[start] = "2"
+            board.place_road(start, end, "2")
         return board
 
     @staticmethod
@@ -581,17 +1105,16 @@ class ExampleBoards:
         def place_spot_for_owner_id(board, owner_id):
             vertex_id = BoardUtils.highest_production_spot(board)
             vertex_cell = board.vertex_cells[vertex_id]
-            vertex_cell.owner_id = owner_id
-            vertex_cell.building = BuildingType.settlement
+            board.place_settlement(vertex_id, owner_id)
             neighbour_id = random.choice(vertex_cell.neighbor_vertexes)
-            vertex_cell.roads[neighbour_id] = owner_id
-            board.vertex_cells[neighbour_id].roads[vertex_id] = owner_id
+            board.place_road(vertex_id, neighbour_id, owner_id)
             for hex_id in vertex_cell.neighbor_hexes:
                 resource_type = board.hex_cells[hex_id].resource_type
                 if resource_type == ResourceType.desert:
                     continue
                 board.players[owner_id].resources[resource_type] += 1
                 board.bank.resources[resource_type] -= 1
+            board.touch('resources')
             return board
 
         board = BoardUtils.setup_board()
@@ -0,0 +1,66 @@
+"""
+Per-game publish/subscribe for the app's server-sent event streams.
+
+Every subscriber of a game gets its own bounded queue, and publish() puts the
+event in all of them without blocking. A subscriber that falls max_pending
+events behind gets None instead, which ends its stream: an EventSource then
+reconnects by itself with the last version it saw and catches up with one
+delta. Only the standard library is used, no broker.
+
+    subscription = broadcaster.subscribe('game_state1')
+    broadcaster.publish('game_state1', delta) # from the request that changed the game
+    event = subscription.get(timeout=15) # in the stream of every subscriber
+    broadcaster.unsubscribe('game_state1', subscription)
+"""
+import json
+import queue
+import threading
+
+
+def format_event(data, event_id=None):
+    """A server-sent event with JSON data, event_id comes back as the Last-Event-ID header on reconnects"""
+    lines = f'id: {event_id}\n' if event_id is not None else ''
+    return f'{lines}data: {json.dumps(data)}\n\n'
+
+
+class Broadcaster:
+    def __init__(self, max_pending=64):
+        self.max_pending = max_pending # events a subscriber can be behind before it is dropped
+        self.subscribers = {} # {game_id: set of queue.Queue}
+        self.lock = threading.Lock()
+
+    def subscribe(self, game_id):
+        subscription = queue.Queue(self.max_pending)
+        with self.lock:
+            self.subscribers.setdefault(game_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, game_id, subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(game_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self.subscribers[game_id]
+
+    def has_subscribers(self, game_id):
+        return game_id in self.subscribers
+
+    def publish(self, game_id, event):
+        with self.lock:
+            subscriptions = list(self.subscribers.get(game_id, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.put_nowait(event)
+            except queue.Full:
+                self.drop(game_id, subscription)
+
+    def drop(self, game_id, subscription):
+        """Ends a subscriber's stream: its pending events are replaced by None"""
+        self.unsubscribe(game_id, subscription)
+        while True:
+            try:
+                subscription.get_nowait()
+            except queue.Empty:
+                break
+        subscription.put_nowait(None)
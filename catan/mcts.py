@@ -0,0 +1,222 @@
+"""
+Monte-Carlo Tree Search player for Catan.
+
+Decision nodes expand the actions of BoardUtils.possible_next_actions (plus
+ending the turn) for the player to move, and ending the turn leads to a chance
+node where the next player's dice roll is sampled. Leaves are played out for a
+few turns with a cheap build-first policy and scored by victory points (1 for
+a win). Every player maximises their own score (UCT on their share).
+
+The search runs on one clone of the board with Board.apply / Board.undo. The
+tree is kept between calls and found again by state, so the part of the tree
+that matches what was actually played is reused, including across opponents'
+turns. With workers > 1, extra independent searches from the same position run
+in a process pool (root parallelisation) and their root statistics are merged.
+All bots share one pool of POOL_WORKERS processes, so searches asking for more
+workers than that queue up in it instead of starting more processes.
+
+Works as a simulate.py bot (--bots mcts,greedy,greedy,greedy) and behind the
+app's /api/ai-turn endpoint.
+"""
+import math
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from catan import BoardUtils, BuildingType
+
+END_TURN = ('end_turn', None)
+
+POOL_WORKERS = max(1, (os.cpu_count() or 1) - 1) # the searching process is the remaining one
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    """The pool shared by all bots, the app creates a bot per player. Started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+        return _pool
+
+
+def state_key(board, kind):
+    """Identifies a position for tree reuse, kind tells decision nodes from chance nodes"""
+    index = board.get_index()
+    return (kind, board.current_player, tuple(index.settlements.values()), tuple(index.cities.values()),
+            tuple(index.networks.values()), index.roads, board.get_resource_counts())
+
+
+class Node:
+    __slots__ = ('key', 'player_id', 'actions', 'children', 'visits', 'rewards')
+
+    def __init__(self, key, player_id):
+        self.key = key
+        self.player_id = player_id
+        self.actions = None # untried actions, filled on the first visit
+        self.children = {} # {action: Node} for decision nodes, {dice sum: Node} for chance nodes
+        self.visits = 0
+        self.rewards = {} # {player_id: total reward}
+
+    def value(self, player_id):
+        return self.rewards.get(player_id, 0.0) / self.visits if self.visits else 0.0
+
+
+class MCTSBot:
+    def __init__(self, rng=None, iterations=200, time_budget_ms=None, workers=1, exploration=0.7,
+                 rollout_turns=8, target_points=10):
+        self.rng = rng or random.Random()
+        self.iterations = iterations # per search process, None to only use the time budget
+        self.time_budget_ms = time_budget_ms
+        self.workers = workers # processes searching in parallel, 1 searches in this process only
+        self.exploration = exploration # UCT constant
+        self.rollout_turns = rollout_turns
+        self.target_points = target_points
+        self.nodes = {} # {state key: Node} of the kept tree
+
+    def choose_setup(self, board, player_id):
+        vertex_id = BoardUtils.highest_production_spot(board)
+        return vertex_id, self.rng.choice(board.vertex_cells[vertex_id].neighbor_vertexes)
+
+    def choose_action(self, board, player_id, actions=None):
+        """Best action for the player to move after their roll, None to end the turn"""
+        board = board.clone()
+        root = self.nodes.get(state_key(board, 'decision'))
+        if root is None:
+            root = Node(state_key(board, 'decision'), player_id)
+
+        futures = []
+        if self.workers > 1:
+            pool = _get_pool()
+            futures = [pool.submit(search_root_stats, board, self.rng.getrandbits(64), self.iterations,
+                                   self.time_budget_ms, self.exploration, self.rollout_turns, self.target_points)
+                       for _ in range(self.workers - 1)]
+        # A reused root keeps its old visits, only this search's visits are merged with the workers'
+        before = {action: child.visits for action, child in root.children.items()}
+        self.search(board, root)
+
+        stats = {action: child.visits - before.get(action, 0) for action, child in root.children.items()}
+        for future in futures:
+            for action, visits in future.result().items():
+                stats[action] = stats.get(action, 0) + visits
+        if not stats:
+            return None
+        action = max(stats, key=stats.get)
+
+        # Keep the subtree of the chosen action for the next call
+        child = root.children.get(action)
+        self.nodes = {}
+        if child is not None:
+            stack = [child]
+            while stack:
+                node = stack.pop()
+                self.nodes[node.key] = node
+                stack.extend(node.children.values())
+        return None if action == END_TURN else action
+
+    def search(self, board, root):
+        deadline = time.perf_counter() + self.time_budget_ms / 1000 if self.time_budget_ms else None
+        iteration = 0
+        while self.iterations is None or iteration < self.iterations:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            self.iterate(board, root)
+            iteration += 1
+        return root
+
+    def iterate(self, board, root):
+        """One selection, expansion, rollout and backpropagation, leaving board as it was"""
+        records = []
+        path = [root]
+        node = root
+        winner = None
+        while winner is None:
+            if node.player_id is None: # chance node, the next player rolls
+                dice_sum = self.rng.randint(1, 6) + self.rng.randint(1, 6)
+                records.append(board.apply(board.current_player, ('roll', dice_sum)))
+                child = node.children.get(dice_sum)
+                if child is None:
+                    child = node.children[dice_sum] = Node(state_key(board, 'decision'), board.current_player)
+                node = child
+                path.append(node)
+                continue
+
+            if node.actions is None:
+                node.actions = self.legal_actions(board, node.player_id)
+                self.rng.shuffle(node.actions)
+            expanding = bool(node.actions)
+            action = node.actions.pop() if expanding else self.select(node)
+            records.append(board.apply(node.player_id, action))
+            if action == END_TURN:
+                key, player_id = state_key(board, 'chance'), None
+            else:
+                if BoardUtils.victory_points(board, node.player_id) >= self.target_points:
+                    winner = node.player_id
+                key, player_id = state_key(board, 'decision'), node.player_id
+            child = node.children.get(action)
+            if child is None:
+                child = node.children[action] = Node(key, player_id)
+            node = child
+            path.append(node)
+            if expanding:
+                break
+
+        if winner is None:
+            rewards = self.rollout(board, records)
+        else:
+            rewards = {winner: 1.0}
+        for node in path:
+            node.visits += 1
+            for player_id, reward in rewards.items():
+                node.rewards[player_id] = node.rewards.get(player_id, 0.0) + reward
+        while records:
+            board.undo(records.pop())
+
+    def legal_actions(self, board, player_id):
+        actions = BoardUtils.possible_next_actions(board, player_id)
+        return [(name, target) for name in (BuildingType.city.name, BuildingType.settlement.name, 'roads')
+                for target in actions.get(name, [])] + [END_TURN]
+
+    def select(self, node):
+        """UCT from the point of view of the player to move"""
+        log_visits = math.log(node.visits)
+        def uct(item):
+            child = item[1]
+            return child.value(node.player_id) + self.exploration * math.sqrt(log_visits / child.visits)
+        return max(node.children.items(), key=uct)[0]
+
+    def rollout(self, board, records):
+        """Plays on with random builds (cities and settlements first), returns {player_id: reward}"""
+        for _ in range(self.rollout_turns):
+            player_id = board.current_player
+            for _ in range(5):
+                actions = BoardUtils.possible_next_actions(board, player_id)
+                builds = actions.get(BuildingType.city.name, []) + actions.get(BuildingType.settlement.name, [])
+                if builds:
+                    vertex_id = self.rng.choice(builds)
+                    name = BuildingType.city.name if board.vertex_cells[vertex_id].building else BuildingType.settlement.name
+                    records.append(board.apply(player_id, (name, vertex_id)))
+                    if BoardUtils.victory_points(board, player_id) >= self.target_points:
+                        return {player_id: 1.0}
+                elif actions.get('roads') and self.rng.random() < 0.5:
+                    records.append(board.apply(player_id, ('roads', self.rng.choice(actions['roads']))))
+                else:
+                    break
+            records.append(board.apply(player_id, END_TURN))
+            records.append(board.apply(board.current_player, ('roll', self.rng.randint(1, 6) + self.rng.randint(1, 6))))
+
+        # Nobody won, share of the victory points on the board
+        points = {player_id: BoardUtils.victory_points(board, player_id) for player_id in board.players}
+        total = sum(points.values()) or 1
+        return {player_id: p / total for player_id, p in points.items()}
+
+
+def search_root_stats(board, seed, iterations, time_budget_ms, exploration, rollout_turns, target_points):
+    """Independent search in a worker process, returns {action: visits} at the root"""
+    bot = MCTSBot(random.Random(seed), iterations, time_budget_ms, 1, exploration, rollout_turns, target_points)
+    root = bot.search(board, Node(state_key(board, 'decision'), board.current_player))
+    return {action: child.visits for action, child in root.children.items()}
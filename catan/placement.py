@@ -0,0 +1,100 @@
+"""
+Vectorized scoring of settlement spots.
+
+Every vertex is scored in one NumPy pass: a fixed vertex x hex incidence
+matrix (from TOPOLOGY) times per-hex features (pips of the number, resource
+type, robber). The score is a weighted sum of objectives:
+
+    production  pips of the neighbouring hexes without the robber, each resource scaled by resource_weights
+    diversity   number of different resources produced
+    scarcity    pips scaled by how rare that resource's production is on this board (average resource = 1)
+
+PlacementScorer().rank(board, k) returns the k best legal spots, best first.
+The default weights (production only) rank exactly like summing pips, which
+is what BoardUtils.highest_production_spot uses.
+"""
+from weakref import WeakKeyDictionary
+
+import numpy as np
+
+from catan import PIP_VALUES, RESOURCE_TYPES, TOPOLOGY
+
+FIRST_HEX = TOPOLOGY.hex_ids[0]
+
+# VERTEX_HEX[v, h] = 1 if vertex v touches hex h (hex ids counted from FIRST_HEX)
+VERTEX_HEX = np.zeros((len(TOPOLOGY.vertex_ids), len(TOPOLOGY.hex_ids)))
+for _vertex_id in TOPOLOGY.vertex_ids:
+    for _hex_id in TOPOLOGY.neighbor_hexes[_vertex_id]:
+        VERTEX_HEX[_vertex_id, _hex_id - FIRST_HEX] = 1
+
+DEFAULT_WEIGHTS = {
+    'production': 1.0,
+    'diversity': 0.0,
+    'scarcity': 0.0,
+}
+
+
+_static_features = WeakKeyDictionary() # {board: (pips, resources)}, numbers and resources don't change after setup
+
+
+def hex_features(board):
+    """(pips, resources, robber) per hex: pips (H,), one-hot RESOURCE_TYPES (H, 5, all zero for the desert), robber (H,)"""
+    hex_cells = [board.hex_cells[hex_id] for hex_id in TOPOLOGY.hex_ids]
+    static = _static_features.get(board)
+    if static is None:
+        pips = np.array([PIP_VALUES.get(h.resource_number, 0) for h in hex_cells], dtype=float)
+        resources = np.zeros((len(hex_cells), len(RESOURCE_TYPES)))
+        for i, h in enumerate(hex_cells):
+            if h.resource_type in RESOURCE_TYPES:
+                resources[i, RESOURCE_TYPES.index(h.resource_type)] = 1
+        static = _static_features[board] = (pips, resources)
+    robber = np.fromiter((h.robber for h in hex_cells), dtype=bool, count=len(hex_cells))
+    return static[0], static[1], robber
+
+
+def free_spots(board):
+    """Boolean (V,) of the vertices where a settlement can go, from the board index"""
+    free = TOPOLOGY.all_vertices_mask & ~board.get_index().blocked
+    bits = np.frombuffer(free.to_bytes((len(TOPOLOGY.vertex_ids) + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(bits, bitorder='little')[:len(TOPOLOGY.vertex_ids)].astype(bool)
+
+
+class PlacementScorer:
+    def __init__(self, weights=None, resource_weights=None):
+        weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+        unknown = set(weights) - set(DEFAULT_WEIGHTS)
+        if unknown:
+            raise ValueError(f"Unknown placement objectives: {sorted(unknown)}")
+        self.weights = weights
+        # {ResourceType: multiplier} for production, e.g. favour wood and brick early on
+        resource_weights = resource_weights or {}
+        self.resource_weights = np.array([resource_weights.get(r, 1.0) for r in RESOURCE_TYPES])
+
+    def score_all(self, board):
+        """Score of every vertex (V,), whether it is free or not"""
+        pips, resources, robber = hex_features(board)
+        hex_resource_pips = (pips * ~robber)[:, None] * resources # (H, 5)
+        vertex_resource_pips = VERTEX_HEX @ hex_resource_pips # (V, 5)
+
+        scores = self.weights['production'] * (vertex_resource_pips @ self.resource_weights)
+        if self.weights['diversity']:
+            scores += self.weights['diversity'] * (vertex_resource_pips > 0).sum(axis=1)
+        if self.weights['scarcity']:
+            totals = hex_resource_pips.sum(axis=0)
+            rarity = np.divide(totals.mean(), totals, out=np.zeros_like(totals), where=totals > 0)
+            scores += self.weights['scarcity'] * (vertex_resource_pips @ rarity)
+        return scores
+
+    def rank(self, board, k=None, spots=None):
+        """The k best (vertex_id, score) among spots (default: every legal settlement spot), best first, ties by vertex id"""
+        spots = np.flatnonzero(free_spots(board)) if spots is None else np.asarray(spots, dtype=int)
+        scores = self.score_all(board)[spots]
+        order = np.argsort(-scores, kind='stable')[:k]
+        return [(int(spots[i]), float(scores[i])) for i in order]
+
+    def best_spot(self, board):
+        ranked = self.rank(board, 1)
+        return ranked[0][0] if ranked else None
+
+
+DEFAULT_SCORER = PlacementScorer()
@@ -0,0 +1,254 @@
+"""
+Headless Catan games between bots.
+
+Plays the turn sequence (roll, build, end turn) with EndpointHelpers and
+BoardUtils, asking a bot for every decision, across a process pool. Streams
+one JSON line per finished game and prints aggregate stats (win rates per bot
+and seat, turns to finish, resources collected and spent) at the end. Every
+game is seeded with seed + game index, and seats are rotated between games so
+no bot always goes first.
+
+    python simulate.py --games 1000 --bots greedy,random,random,random --output results.jsonl
+
+A bot is a class taking a random.Random with two methods:
+    choose_setup(board, player_id) -> (vertex_id, road_end_vertex_id) for a starting settlement and road
+    choose_action(board, player_id, actions) -> (action name, target) from actions
+                                                (board.get_next_actions) or None to end the turn
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from multiprocessing import Pool
+
+from catan import TOPOLOGY, BoardUtils, BuildingType, EndpointHelpers, ResourceType
+from mcts import MCTSBot
+
+PLAYER_IDS = ['1', '2', '3', '4']
+
+
+class RandomBot:
+    """Random starting spots, then any legal action or ending the turn with equal chance"""
+    def __init__(self, rng):
+        self.rng = rng
+
+    def choose_setup(self, board, player_id):
+        vertex_id = self.rng.choice(BoardUtils.valid_settlements(board))
+        return vertex_id, self.rng.choice(TOPOLOGY.neighbor_vertexes[vertex_id])
+
+    def choose_action(self, board, player_id, actions):
+        choices = [(name, target) for name in (BuildingType.city.name, BuildingType.settlement.name, 'roads')
+                   for target in actions.get(name, [])]
+        choices.append(None)
+        return self.rng.choice(choices)
+
+
+class GreedyBot:
+    """
+    Starts on BoardUtils.highest_production_spot, then builds the most productive city or settlement it can.
+    Only builds roads when its network has no free settlement spot, towards the most productive one.
+    """
+    def __init__(self, rng):
+        self.rng = rng
+
+    def choose_setup(self, board, player_id):
+        vertex_id = BoardUtils.highest_production_spot(board)
+        return vertex_id, self.rng.choice(TOPOLOGY.neighbor_vertexes[vertex_id])
+
+    def choose_action(self, board, player_id, actions):
+        pips = lambda vertex_id: BoardUtils.vertex_pips(board, vertex_id)
+        for name in (BuildingType.city.name, BuildingType.settlement.name):
+            if actions.get(name):
+                return name, max(actions[name], key=pips)
+
+        index = board.get_index()
+        network = index.networks[player_id]
+        if not actions.get('roads') or network & ~index.blocked:
+            return None # save up for the settlement
+        def road_value(road):
+            new_vertex = road[1] if network >> road[0] & 1 else road[0]
+            return (not index.blocked >> new_vertex & 1, pips(new_vertex))
+        return 'roads', max(actions['roads'], key=road_value)
+
+
+BOTS = {
+    'random': RandomBot,
+    'greedy': GreedyBot,
+    'mcts': MCTSBot,
+}
+
+
+def resource_counts(board):
+    return {player_id: dict(player.resources) for player_id, player in board.players.items()}
+
+
+def add_flow(totals, before, after, sign):
+    """Adds sign * (after - before) per player and resource to totals"""
+    for player_id, resources in after.items():
+        for resource_type, count in resources.items():
+            totals[player_id][resource_type.name] += sign * (count - before[player_id][resource_type])
+
+
+def place_starting_spot(board, player_id, vertex_id, road_end):
+    """Free settlement and road, paying out the neighbouring hexes once like ExampleBoards"""
+    board.place_settlement(vertex_id, player_id)
+    board.place_road(vertex_id, road_end, player_id)
+    for hex_id in TOPOLOGY.neighbor_hexes[vertex_id]:
+        resource_type = board.hex_cells[hex_id].resource_type
+        if resource_type != ResourceType.desert and board.bank.resources[resource_type] > 0:
+            board.players[player_id].resources[resource_type] += 1
+            board.bank.resources[resource_type] -= 1
+    board.touch('resources')
+
+
+def apply_action(board, player_id, action):
+    name, target = action
+    if name == BuildingType.city.name:
+        EndpointHelpers.handle_build_city(board, target, player_id)
+    elif name == BuildingType.settlement.name:
+        EndpointHelpers.handle_place_settlement(board, target, player_id)
+    else:
+        EndpointHelpers.handle_place_road(board, target[0], target[1], player_id)
+
+
+def play_game(game_index, seed, bot_names, target_points=10, max_turns=1000, max_actions=20):
+    """Plays one game until a player reaches target_points or max_turns, returns its result record"""
+    rng = random.Random(seed) # dice and bots, the board comes from setup_board(seed), nothing uses the global RNG
+    seats = dict(zip(PLAYER_IDS, bot_names))
+    bots = {player_id: BOTS[name](random.Random(rng.getrandbits(64))) for player_id, name in seats.items()}
+    collected = {player_id: {r.name: 0 for r in ResourceType if r != ResourceType.desert} for player_id in PLAYER_IDS}
+    spent = {player_id: dict(resources) for player_id, resources in collected.items()}
+
+    t0 = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull): # the helpers print every step
+        board = BoardUtils.setup_board(seed)
+        for player_id in PLAYER_IDS + PLAYER_IDS[::-1]:
+            place_starting_spot(board, player_id, *bots[player_id].choose_setup(board, player_id))
+
+        winner = None
+        turn = 0
+        while winner is None and turn < max_turns:
+            turn += 1
+            player_id = board.current_player
+            before = resource_counts(board)
+            BoardUtils.collect_resources(board, rng.randint(1, 6) + rng.randint(1, 6), player_id)
+            add_flow(collected, before, resource_counts(board), 1)
+
+            for _ in range(max_actions):
+                action = bots[player_id].choose_action(board, player_id, board.get_next_actions(player_id))
+                if action is None:
+                    break
+                before = resource_counts(board)
+                apply_action(board, player_id, action)
+                add_flow(spent, before, resource_counts(board), -1)
+                if BoardUtils.victory_points(board, player_id) >= target_points:
+                    winner = player_id
+                    break
+            EndpointHelpers.handle_end_turn(board)
+
+    road_counts = dict.fromkeys(PLAYER_IDS, 0)
+    for vertex in board.vertex_cells.values():
+        for other_id, owner_id in vertex.roads.items():
+            if vertex.unique_id < other_id:
+                road_counts[owner_id] += 1
+    return {
+        'game': game_index,
+        'seed': seed,
+        'bots': seats,
+        'winner': winner,
+        'winner_bot': seats.get(winner),
+        'turns': turn,
+        'points': {player_id: BoardUtils.victory_points(board, player_id) for player_id in PLAYER_IDS},
+        'roads': road_counts,
+        'collected': collected,
+        'spent': spent,
+        'seconds': time.perf_counter() - t0,
+    }
+
+
+def _play_game_star(args):
+    return play_game(*args)
+
+
+def run(games, bot_names, seed=0, workers=None, output=None, target_points=10, max_turns=1000, rotate=True):
+    """Plays games in a process pool, writing each result to output as it finishes. Returns all results."""
+    jobs = []
+    for i in range(games):
+        shift = i % len(bot_names) if rotate else 0
+        jobs.append((i, seed + i, bot_names[shift:] + bot_names[:shift], target_points, max_turns))
+    results = []
+    with Pool(processes=workers) as pool:
+        for result in pool.imap_unordered(_play_game_star, jobs):
+            results.append(result)
+            if output is not None:
+                output.write(json.dumps(result) + '\n')
+                output.flush()
+    return results
+
+
+def summarize(results):
+    finished = [r for r in results if r['winner'] is not None]
+    seat_counts, win_counts = {}, {}
+    for r in results:
+        for player_id, name in r['bots'].items():
+            seat_counts[name] = seat_counts.get(name, 0) + 1
+        if r['winner'] is not None:
+            win_counts[r['winner_bot']] = win_counts.get(r['winner_bot'], 0) + 1
+
+    def mean_flow(key):
+        totals = {}
+        for r in results:
+            for resources in r[key].values():
+                for name, count in resources.items():
+                    totals[name] = totals.get(name, 0) + count
+        return {name: count / (len(results) * len(PLAYER_IDS)) for name, count in totals.items()}
+
+    turns = sorted(r['turns'] for r in finished)
+    return {
+        'games': len(results),
+        'finished': len(finished),
+        'mean_turns': sum(turns) / len(turns) if turns else None,
+        'median_turns': turns[len(turns) // 2] if turns else None,
+        # wins per seat the bot played, 0.25 is an even share with 4 players
+        'win_rate_by_bot': {name: win_counts.get(name, 0) / count for name, count in sorted(seat_counts.items())},
+        'win_rate_by_seat': {player_id: sum(1 for r in finished if r['winner'] == player_id) / len(results)
+                             for player_id in PLAYER_IDS},
+        'mean_collected_per_player': mean_flow('collected'),
+        'mean_spent_per_player': mean_flow('spent'),
+        'mean_seconds_per_game': sum(r['seconds'] for r in results) / len(results),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Headless Catan games between bots')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--bots', default='greedy,random,random,random',
+                        help=f'comma separated bot per seat, from {sorted(BOTS)}')
+    parser.add_argument('--target-points', type=int, default=10)
+    parser.add_argument('--max-turns', type=int, default=1000)
+    parser.add_argument('--no-rotate', action='store_true', help='keep every bot in its seat for all games')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--output', default='-', help='JSONL file for per-game results, - for stdout')
+    args = parser.parse_args(argv)
+
+    bot_names = args.bots.split(',')
+    if len(bot_names) != len(PLAYER_IDS) or not set(bot_names) <= BOTS.keys():
+        parser.error(f'--bots needs {len(PLAYER_IDS)} names from {sorted(BOTS)}')
+
+    t0 = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        output = sys.stdout if args.output == '-' else stack.enter_context(open(args.output, 'w'))
+        results = run(args.games, bot_names, args.seed, args.workers, output,
+                      args.target_points, args.max_turns, not args.no_rotate)
+
+    summary = summarize(results)
+    summary['seconds'] = time.perf_counter() - t0
+    print(json.dumps(summary), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
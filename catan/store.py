@@ -0,0 +1,437 @@
+"""
+In-memory game store for the Flask app.
+
+Boards stay in memory between requests, so reading a game is a dict lookup.
+Changes are written to disk by a background thread (write-behind): a game is
+saved flush_delay seconds after its first unsaved change, or after flush_every
+unsaved changes, whichever comes first. Everything left is flushed on close(),
+which also runs at interpreter exit. Don't call flush() or close() while
+holding a board from read() or edit(). If writing a log fails (disk full, I/O
+error), the error is printed and the game is saved again later with its new
+actions put back in front of any that came since.
+
+Games are only created by asking for them with create=True, read(), edit()
+and put() of a game that doesn't exist raise GameNotFound otherwise.
+
+Every game has its own lock, so requests to one game are serialized while
+different games run in parallel. At most capacity games are kept in memory:
+past that, the least recently used games that are saved and not in use are
+dropped and loaded from disk again when needed. on_evict(game_id) is called for
+every dropped game, so callers can let go of what they keep per game.
+
+A game is saved as an append-only action log, not as a pickled board. Boards
+in the store record what is played on them in board.log (Board.apply and the
+dice rolls of EndpointHelpers.handle_roll_dice), and saving appends those
+actions to games/<game_id>.log, one JSON line each after a header line:
+
+    {"seed": 1234, "id": "9f.."}   setup_board seed, or null and the starting "snapshot", and the log's id
+    ["1", "roll", 8]                player id, action name and target, as for Board.apply
+    ["1", "roads", [12, 13]]
+    ["1", "end_turn", null]
+
+Every snapshot_every actions, a CompactBoard of the position is written to
+games/<game_id>.snap with the log's id and the number of logged actions it
+includes. Loading a game restores the latest snapshot of its log (or its
+starting position) and replays the actions after it. The log keeps the whole
+game for replays and audits, see replay_log(). A board given to put() starts
+a new log, which has the board as its starting snapshot unless it is fresh
+from setup_board(seed).
+
+Files are only replaced whole (write_atomic) or appended to, in an order that
+leaves a loadable game at every point a crash can stop a save: a new log
+needs no other file, and a .snap is written after the actions it includes,
+and ignored once it belongs to an older log.
+
+    store = GameStore('games')
+    with store.edit('game_state1', create=True) as board: # the change is saved in the background
+        EndpointHelpers.handle_end_turn(board)
+    with store.read('game_state1') as board:
+        state = board.get_board_state()
+"""
+import atexit
+import base64
+import json
+import os
+import pickle
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from catan import BoardUtils, CompactBoard
+
+
+def write_atomic(path, data):
+    """Writes data through a temporary file, readers see the old or the new file, never a partial one"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno()) # on disk before it replaces the old file, not only after
+    os.replace(tmp_path, path)
+
+
+def encode_action(player_id, action):
+    name, target = action
+    return json.dumps([player_id, name, target]) + '\n'
+
+
+def decode_action(line):
+    player_id, name, target = json.loads(line)
+    return player_id, (name, tuple(target) if isinstance(target, list) else target)
+
+
+def encode_header(seed, log_id, snapshot=None):
+    """First line of a log, snapshot is the CompactBoard it starts from if the seed is None"""
+    header = {'seed': seed, 'id': log_id}
+    if snapshot is not None:
+        header['snapshot'] = base64.b64encode(pickle.dumps(snapshot)).decode()
+    return json.dumps(header) + '\n'
+
+
+def read_log(path):
+    """(header, [(player_id, action)]) of a log file. A last line cut off by a crash is dropped from the file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    end = data.rfind(b'\n') + 1
+    if end < len(data):
+        with open(path, 'r+b') as f:
+            f.truncate(end)
+    lines = data[:end].decode().splitlines()
+    return json.loads(lines[0]), [decode_action(line) for line in lines[1:]]
+
+
+def read_snapshot(path):
+    """(log id, logged actions, CompactBoard) of a .snap file, None if there is none"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def replay(header, actions, snapshot_path=None, new_board=BoardUtils.setup_board):
+    """
+    The board after actions, from the snapshot if it is given, exists, is of this log and is not past them,
+    otherwise from the log's starting snapshot or seed
+    """
+    seed, start = header['seed'], 0
+    snapshot = read_snapshot(snapshot_path) if snapshot_path is not None else None
+    if snapshot is not None and snapshot[0] == header['id'] and snapshot[1] <= len(actions):
+        _, start, compact = snapshot
+    elif header.get('snapshot') is not None:
+        compact = pickle.loads(base64.b64decode(header['snapshot']))
+    elif seed is None:
+        raise ValueError('The log starts from a snapshot that is not available')
+    else:
+        compact = None
+    if compact is not None:
+        board = compact.to_board()
+        board.seed = seed
+    else:
+        board = new_board(seed)
+    for player_id, action in actions[start:]:
+        board.apply(player_id, action)
+    return board
+
+
+def replay_log(path, count=None, snapshot_path=None):
+    """The board of a saved game after its first count actions (all if None)"""
+    header, actions = read_log(path)
+    return replay(header, actions[:count], snapshot_path)
+
+
+class GameNotFound(KeyError):
+    pass
+
+
+class GameStore:
+    def __init__(self, directory='games', capacity=256, flush_delay=1.0, flush_every=20, snapshot_every=200,
+                 new_board=BoardUtils.setup_board, on_evict=None):
+        self.directory = directory
+        self.capacity = capacity # games kept in memory, more only while they have unsaved changes or are in use
+        self.flush_delay = flush_delay
+        self.flush_every = flush_every
+        self.snapshot_every = snapshot_every # logged actions between snapshots, loading replays fewer than that
+        self.new_board = new_board # new_board(seed) makes the board of a game that is not on disk yet
+        self.on_evict = on_evict # on_evict(game_id) when a game is dropped from memory, holding self.lock: keep it short
+        self.boards = OrderedDict() # {game_id: Board}, least recently used first
+        self.game_locks = {} # {game_id: RLock} held while a board is read, changed or saved
+        self.dirty = {} # {game_id: (time of the first unsaved change, unsaved change count)}
+        self.saving = set() # games taken out of dirty whose files are still being written
+        self.logged = {} # {game_id: actions in the log file}
+        self.log_ids = {} # {game_id: id of the log file}, snapshots of other logs are stale
+        self.new_logs = {} # {game_id: seed or starting CompactBoard} of games to save in a new log
+        self.lock = threading.Lock() # guards the dicts above, only held briefly, taken after a game lock
+        self.io_lock = threading.Lock() # keeps saves in order, taken before any other lock
+        self.changed = threading.Condition(self.lock)
+        self.closed = False
+        os.makedirs(directory, exist_ok=True)
+
+        self.writer = threading.Thread(target=self._write_behind, name='GameStore writer', daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+    def path(self, game_id, extension='log'):
+        return os.path.join(self.directory, f'{game_id}.{extension}')
+
+    def _acquire(self, game_id):
+        """Takes the lock of a game, returns it to release"""
+        while True:
+            with self.lock:
+                game_lock = self.game_locks.setdefault(game_id, threading.RLock())
+            game_lock.acquire()
+            with self.lock:
+                if self.game_locks.get(game_id) is game_lock:
+                    return game_lock
+            game_lock.release() # the game was evicted while we waited, its lock is not used anymore
+
+    def _exists(self, game_id):
+        with self.lock:
+            if game_id in self.boards:
+                return True
+        return os.path.exists(self.path(game_id)) or os.path.exists(self.path(game_id, 'pkl'))
+
+    def _not_found(self, game_id):
+        """Raises GameNotFound, forgetting the lock _acquire made for the game"""
+        with self.lock:
+            if game_id not in self.boards:
+                self.game_locks.pop(game_id, None)
+        raise GameNotFound(game_id)
+
+    def _load(self, game_id, create=False):
+        """The board of a game whose lock is held, from memory, disk or new_board if create"""
+        with self.lock:
+            board = self.boards.get(game_id)
+            if board is not None:
+                self.boards.move_to_end(game_id)
+                return board
+
+        # Only this game's lock is held while reading the files, other games go on
+        logged = new_log = None
+        if os.path.exists(self.path(game_id)):
+            header, actions = read_log(self.path(game_id))
+            board = replay(header, actions, self.path(game_id, 'snap'), self.new_board)
+            logged = len(actions)
+        elif os.path.exists(self.path(game_id, 'pkl')): # saved as a whole board before the action log
+            with open(self.path(game_id, 'pkl'), 'rb') as f:
+                board = pickle.load(f)
+            new_log = CompactBoard.from_board(board)
+        elif not create:
+            self._not_found(game_id)
+        else:
+            print(f'GameStore | Setting up new game {game_id}')
+            board = self.new_board(random.getrandbits(64))
+            new_log = board.seed if board.seed is not None else CompactBoard.from_board(board)
+        board.log = []
+        with self.lock:
+            self.boards[game_id] = board
+            if logged is None:
+                self.new_logs[game_id] = new_log
+                self._mark_dirty(game_id)
+            else:
+                self.logged[game_id] = logged
+                self.log_ids[game_id] = header['id']
+            self._evict(keep=game_id)
+        return board
+
+    def _evict(self, keep=None):
+        """Drops least recently used games past capacity that are saved and not in use, holding self.lock"""
+        for game_id in list(self.boards):
+            if len(self.boards) <= self.capacity:
+                break
+            if game_id == keep or game_id in self.dirty or game_id in self.saving:
+                continue
+            game_lock = self.game_locks[game_id]
+            if game_lock.acquire(blocking=False):
+                del self.boards[game_id]
+                del self.game_locks[game_id]
+                del self.logged[game_id]
+                del self.log_ids[game_id]
+                if self.on_evict is not None:
+                    self.on_evict(game_id)
+                game_lock.release()
+
+    def _mark_dirty(self, game_id):
+        first_change, count = self.dirty.get(game_id, (time.monotonic(), 0))
+        self.dirty[game_id] = (first_change, count + 1)
+        self.changed.notify()
+
+    @contextmanager
+    def read(self, game_id, create=False):
+        """The live board of a game, loaded from disk or created if needed and create. Don't change it."""
+        game_lock = self._acquire(game_id)
+        try:
+            yield self._load(game_id, create)
+        finally:
+            game_lock.release()
+
+    @contextmanager
+    def edit(self, game_id, create=False):
+        """The live board of a game to change in place, through Board.apply or EndpointHelpers so the changes are logged"""
+        game_lock = self._acquire(game_id)
+        try:
+            board = self._load(game_id, create)
+            try:
+                yield board
+            finally:
+                if board.log:
+                    with self.lock:
+                        self._mark_dirty(game_id)
+        finally:
+            game_lock.release()
+
+    def put(self, game_id, board, create=False):
+        """Replaces a game's board, starting a new log"""
+        game_lock = self._acquire(game_id)
+        try:
+            if not create and not self._exists(game_id):
+                self._not_found(game_id)
+            board.log = []
+            # Version 0 means nothing was changed since setup_board, so its seed (if it had one) gives the same board
+            new_log = board.seed if board.version == 0 and board.seed is not None else CompactBoard.from_board(board)
+            with self.lock:
+                self.boards[game_id] = board
+                self.boards.move_to_end(game_id)
+                self.new_logs[game_id] = new_log
+                self._mark_dirty(game_id)
+                self._evict(keep=game_id)
+        finally:
+            game_lock.release()
+
+    def game_ids(self):
+        """Games in memory and on disk"""
+        with self.lock:
+            game_ids = set(self.boards)
+        for name in os.listdir(self.directory):
+            game_id, extension = os.path.splitext(name)
+            if extension in ('.log', '.pkl'):
+                game_ids.add(game_id)
+        return sorted(game_ids)
+
+    def flush(self, game_id=None):
+        """Saves a game (all games if None) now if it has unsaved changes"""
+        with self.lock:
+            game_ids = [g for g in self.dirty if game_id is None or g == game_id]
+        self._save(game_ids)
+
+    def _save(self, game_ids):
+        """Takes each game's new actions (and snapshot when due) under its lock, and writes them outside it"""
+        with self.io_lock:
+            for game_id in game_ids:
+                game_lock = self._acquire(game_id)
+                try:
+                    with self.lock:
+                        if game_id not in self.dirty: # saved by someone else in the meantime
+                            continue
+                        del self.dirty[game_id]
+                        self.saving.add(game_id) # not evicted before its files are written, they are older
+                        header = base = None
+                        saved = self.logged.get(game_id), self.log_ids.get(game_id) # to put back if writing fails
+                        if game_id in self.new_logs:
+                            base = self.new_logs.pop(game_id)
+                            self.log_ids[game_id] = '%016x' % random.getrandbits(64)
+                            if isinstance(base, CompactBoard):
+                                header = encode_header(None, self.log_ids[game_id], base)
+                            else:
+                                header = encode_header(base, self.log_ids[game_id])
+                            self.logged[game_id] = 0
+                        start = self.logged[game_id]
+                        log_id = self.log_ids[game_id]
+                        board = self.boards[game_id]
+                        actions, board.log = board.log, []
+                        end = self.logged[game_id] = start + len(actions)
+                    snapshot = None
+                    if start // self.snapshot_every != end // self.snapshot_every:
+                        snapshot = pickle.dumps((log_id, end, CompactBoard.from_board(board)))
+                finally:
+                    game_lock.release()
+
+                try:
+                    # A crash between any two steps leaves a log with its snapshot or with a stale one, ignored by id
+                    lines = ''.join(encode_action(player_id, action) for player_id, action in actions)
+                    try:
+                        if header is not None:
+                            write_atomic(self.path(game_id), (header + lines).encode())
+                        elif lines:
+                            self._append(self.path(game_id), lines)
+                    except OSError as error:
+                        print(f'GameStore | Saving {game_id} failed, trying again later: {error}')
+                        self._unsave(game_id, board, actions, base, saved)
+                        continue
+                    try:
+                        self._write_snapshot(game_id, header, snapshot)
+                    except OSError as error: # the actions are saved, loading only replays more of them
+                        print(f'GameStore | Saving the snapshot of {game_id} failed: {error}')
+                finally:
+                    with self.lock:
+                        self.saving.discard(game_id)
+            with self.lock:
+                self._evict() # games past capacity can go now that they are saved
+
+    def _append(self, path, lines):
+        """Appends to a log, or leaves it as it was if that fails"""
+        size = os.path.getsize(path)
+        try:
+            with open(path, 'a') as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno()) # a snapshot is never ahead of the log on disk
+        except OSError:
+            try:
+                os.truncate(path, size) # so the lines are not appended twice when saving again
+            except OSError:
+                pass
+            raise
+
+    def _unsave(self, game_id, board, actions, base, saved):
+        """Puts the actions of a failed save back, to be saved again with the game's next changes"""
+        game_lock = self._acquire(game_id)
+        try:
+            with self.lock:
+                if self.boards.get(game_id) is not board: # replaced by put() meanwhile, with a new log
+                    return
+                board.log[:0] = actions
+                if base is not None:
+                    self.new_logs.setdefault(game_id, base)
+                self.logged[game_id], self.log_ids[game_id] = saved
+                self._mark_dirty(game_id)
+        finally:
+            game_lock.release()
+
+    def _write_snapshot(self, game_id, header, snapshot):
+        if snapshot is not None:
+            write_atomic(self.path(game_id, 'snap'), snapshot)
+        elif header is not None and os.path.exists(self.path(game_id, 'snap')): # of the old log
+            os.remove(self.path(game_id, 'snap'))
+        if header is not None and os.path.exists(self.path(game_id, 'pkl')):
+            os.remove(self.path(game_id, 'pkl'))
+
+    def _due(self):
+        now = time.monotonic()
+        return [game_id for game_id, (first_change, count) in self.dirty.items()
+                if count >= self.flush_every or now - first_change >= self.flush_delay]
+
+    def _write_behind(self):
+        while True:
+            with self.lock:
+                while not self.closed and not self._due():
+                    if self.dirty: # sleep until the oldest change is due
+                        oldest = min(first_change for first_change, _ in self.dirty.values())
+                        self.changed.wait(max(0.0, oldest + self.flush_delay - time.monotonic()))
+                    else:
+                        self.changed.wait()
+                if self.closed:
+                    return
+                due = self._due()
+            self._save(due)
+
+    def close(self):
+        """Stops the writer and saves everything that is left"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.changed.notify_all()
+        self.writer.join()
+        self.flush()
@@ -0,0 +1,80 @@
+import random
+
+import pytest
+
+from catan import BoardUtils, BuildingType, ExampleBoards
+from simulate import PLAYER_IDS, apply_action
+from test_board_index import check_index, random_positions
+
+
+def state(board):
+    """Everything an action can change, comparable between boards"""
+    full = board.get_board_state(players='all')
+    full['roads'] = sorted(full['roads'])
+    index = board.get_index()
+    full['index'] = [dict(index.settlements), dict(index.cities), dict(index.networks), index.blocked, index.roads,
+                     dict(index.payouts)]
+    return full
+
+
+def legal_actions(board, player_id):
+    actions = BoardUtils.possible_next_actions(board, player_id)
+    return [(name, target) for name in (BuildingType.city.name, BuildingType.settlement.name, 'roads')
+            for target in actions.get(name, [])]
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_every_action_round_trips(seed):
+    for position in random_positions(seed, turns=30):
+        board = position.clone()
+        before = state(board)
+        player_id = board.current_player
+        for action in legal_actions(board, player_id) + [('roll', s) for s in range(2, 13)] + [('end_turn', None)]:
+            record = board.apply(player_id, action)
+            board.undo(record)
+            assert state(board) == before, action
+
+
+@pytest.mark.parametrize('seed', range(2))
+def test_action_sequences_undo_in_reverse(seed):
+    rng = random.Random(seed)
+    board = ExampleBoards.example_highest_production_first_spots().clone()
+    for player in board.players.values():
+        for resource_type in player.resources:
+            player.resources[resource_type] = 20
+    states, records = [], []
+    for _ in range(60):
+        player_id = board.current_player
+        choices = legal_actions(board, player_id) + [('roll', rng.randint(2, 12)), ('end_turn', None)]
+        states.append(state(board))
+        records.append(board.apply(player_id, rng.choice(choices)))
+        check_index(board)
+    while records:
+        board.undo(records.pop())
+        assert state(board) == states.pop()
+
+
+def test_apply_matches_endpoint_helpers():
+    board = ExampleBoards.example_highest_production_first_spots()
+    for player in board.players.values():
+        for resource_type in player.resources:
+            player.resources[resource_type] = 20
+    for player_id in PLAYER_IDS:
+        for action in legal_actions(board, player_id)[:20]:
+            applied, helped = board.clone(), board.clone()
+            applied.apply(player_id, action)
+            apply_action(helped, player_id, action)
+            assert state(applied) == state(helped), action
+
+
+def test_clone_is_independent():
+    board = ExampleBoards.example_settlement_cutoff_board()
+    before = state(board)
+    clone = board.clone()
+    player_id = clone.current_player
+    clone.players[player_id].resources = dict.fromkeys(clone.players[player_id].resources, 20)
+    for action in legal_actions(clone, player_id)[:5]:
+        clone.apply(player_id, action)
+    clone.apply(player_id, ('end_turn', None))
+    assert state(clone) != before
+    assert state(board) == before
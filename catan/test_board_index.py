@@ -0,0 +1,112 @@
+import random
+from collections import deque
+
+import pytest
+
+from catan import BoardUtils, BuildingType, EndpointHelpers, ExampleBoards, ResourceType
+from simulate import PLAYER_IDS, RandomBot, apply_action, place_starting_spot
+
+
+def scan_next_actions(board, player_id):
+    """possible_next_actions as it was before the board index: vertex scans and a BFS from every building"""
+    vertices = board.vertex_cells
+    buildings = {v.unique_id for v in vertices.values() if v.owner_id == player_id and v.building is not None}
+    origins = set(buildings)
+    for building_id in buildings:
+        visited = {building_id}
+        queue = deque([building_id])
+        while queue:
+            vertex_id = queue.popleft()
+            for neighbor_id, owner_id in vertices[vertex_id].roads.items():
+                neighbor = vertices[neighbor_id]
+                if neighbor_id in visited or owner_id != player_id:
+                    continue
+                if neighbor.building is not None and neighbor.owner_id != player_id:
+                    continue
+                visited.add(neighbor_id)
+                queue.append(neighbor_id)
+                origins.add(neighbor_id)
+    origins = sorted(origins)
+
+    actions = {'player_id': player_id}
+    cities = [v.unique_id for v in vertices.values() if v.owner_id == player_id and v.building == BuildingType.city]
+    settlements = sorted(v.unique_id for v in vertices.values()
+                         if v.owner_id == player_id and v.building == BuildingType.settlement)
+    resources = board.players[player_id].resources
+    if len(cities) < 5 and resources[ResourceType.ore] >= 3 and resources[ResourceType.wheat] >= 5:
+        actions[BuildingType.city.name] = settlements
+    if len(settlements) < 5 and all(resources[r] > 0 for r in (ResourceType.wood, ResourceType.brick,
+                                                                   ResourceType.wheat, ResourceType.sheep)):
+        free = [v.unique_id for v in vertices.values() if v.building is None
+                and all(vertices[n].building is None for n in v.neighbor_vertexes)]
+        actions[BuildingType.settlement.name] = [v for v in free if v in origins]
+    if resources[ResourceType.wood] > 0 and resources[ResourceType.brick] > 0:
+        actions['roads'] = sorted({(min(v, n), max(v, n)) for v in origins
+                                   for n in vertices[v].neighbor_vertexes if n not in vertices[v].roads})
+    return actions
+
+
+def check_index(board):
+    """Moves from the incrementally kept index match the scan, with the real resources and with plenty of them"""
+    rich = board.clone()
+    for player in rich.players.values():
+        for resource_type in player.resources:
+            player.resources[resource_type] = 10
+    for player_id in PLAYER_IDS:
+        assert BoardUtils.possible_next_actions(board, player_id) == scan_next_actions(board, player_id)
+        assert BoardUtils.possible_next_actions(rich, player_id) == scan_next_actions(rich, player_id)
+
+    rebuilt = board.clone()
+    rebuilt.index = None
+    for name in ('settlements', 'cities', 'networks', 'blocked', 'roads'):
+        assert getattr(rebuilt.get_index(), name) == getattr(board.get_index(), name), name
+
+
+def random_positions(seed, turns=80):
+    """Boards along a game of random bots, every player rich enough to build often"""
+    random.seed(seed)
+    rng = random.Random(seed)
+    bots = {player_id: RandomBot(random.Random(rng.getrandbits(64))) for player_id in PLAYER_IDS}
+    board = BoardUtils.setup_board(seed)
+    for player_id in PLAYER_IDS + PLAYER_IDS[::-1]:
+        place_starting_spot(board, player_id, *bots[player_id].choose_setup(board, player_id))
+        yield board
+    for _ in range(turns):
+        player_id = board.current_player
+        for resource_type in (ResourceType.wood, ResourceType.brick, ResourceType.wheat, ResourceType.sheep):
+            board.players[player_id].resources[resource_type] += 1
+        board.touch('resources')
+        for _ in range(10):
+            action = bots[player_id].choose_action(board, player_id, board.get_next_actions(player_id))
+            if action is None:
+                break
+            apply_action(board, player_id, action)
+            yield board
+        EndpointHelpers.handle_end_turn(board)
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_index_moves_match_scan_in_random_games(seed):
+    for board in random_positions(seed):
+        check_index(board)
+
+
+@pytest.mark.parametrize('make_board', [ExampleBoards.example_settlement_cutoff_board,
+                                        ExampleBoards.example_highest_production_first_spots])
+def test_index_moves_match_scan_on_example_boards(make_board):
+    check_index(make_board())
+
+
+def test_settlement_cuts_opponent_network():
+    board = BoardUtils.setup_board(0)
+    place_starting_spot(board, '1', 0, board.vertex_cells[0].neighbor_vertexes[0])
+    a = board.vertex_cells[0].neighbor_vertexes[0]
+    b = next(n for n in board.vertex_cells[a].neighbor_vertexes if n != 0)
+    c = next(n for n in board.vertex_cells[b].neighbor_vertexes if n != a)
+    board.place_road(a, b, '1')
+    board.place_road(b, c, '1')
+    assert b in BoardUtils.valid_origin_vertices(board, '1') and c in BoardUtils.valid_origin_vertices(board, '1')
+
+    board.place_settlement(b, '2')  # an opponent settles on the middle of the road
+    assert b not in BoardUtils.valid_origin_vertices(board, '1') and c not in BoardUtils.valid_origin_vertices(board, '1')
+    check_index(board)
@@ -0,0 +1,217 @@
+import os
+import random
+import time
+
+import pytest
+
+import store
+from catan import BoardUtils, ExampleBoards
+from store import GameNotFound, GameStore, read_log, replay_log, write_atomic
+from test_apply_undo import legal_actions, state
+
+
+@pytest.fixture
+def games(tmp_path):
+    """A store that only saves on flush()"""
+    game_store = GameStore(str(tmp_path), flush_delay=3600, flush_every=10**9, snapshot_every=7)
+    yield game_store
+    game_store.close()
+
+
+def play(game_store, game_id, turns, rng, create=False):
+    """Random rolls and builds through Board.apply, so they are logged"""
+    for _ in range(turns):
+        with game_store.edit(game_id, create) as board:
+            player_id = board.current_player
+            board.apply(player_id, ('roll', rng.randint(2, 12)))
+            for _ in range(rng.randint(0, 3)):
+                actions = legal_actions(board, player_id)
+                if actions:
+                    board.apply(player_id, rng.choice(actions))
+            board.apply(player_id, ('end_turn', None))
+
+
+def states(game_store, game_ids):
+    result = {}
+    for game_id in game_ids:
+        with game_store.read(game_id) as board:
+            result[game_id] = state(board)
+    return result
+
+
+def test_reload_gives_the_same_boards(games):
+    rng = random.Random(0)
+    games.put('example', ExampleBoards.example_highest_production_first_spots(), create=True)
+    for _ in range(4):
+        for game_id in ('a', 'b', 'example'):
+            play(games, game_id, 3, rng, create=True)
+        games.flush()
+    expected = states(games, ['a', 'b', 'example'])
+    games.close()
+
+    assert os.path.exists(games.path('a', 'snap')) # snapshot_every=7 was passed
+    reloaded = GameStore(games.directory)
+    try:
+        assert states(reloaded, expected) == expected
+    finally:
+        reloaded.close()
+    for game_id, game_state in expected.items():
+        assert state(replay_log(games.path(game_id))) == game_state # from the start, without the snapshot
+
+
+def test_evicted_games_reload(tmp_path):
+    game_store = GameStore(str(tmp_path), capacity=2, flush_delay=3600, flush_every=10**9)
+    rng = random.Random(1)
+    for game_id in 'abcd':
+        play(game_store, game_id, 3, rng, create=True)
+        game_store.flush()
+    assert len(game_store.boards) == 2
+    expected = states(game_store, 'abcd')
+    game_store.close()
+    assert game_store.game_ids() == sorted(expected)
+    reloaded = GameStore(str(tmp_path))
+    try:
+        assert states(reloaded, 'abcd') == expected
+    finally:
+        reloaded.close()
+
+
+def test_boards_without_a_seed_reload(games):
+    board = BoardUtils.setup_board() # fresh but unseeded, so it is saved as a snapshot
+    games.put('a', board, create=True)
+    games.flush()
+    expected = states(games, ['a'])['a']
+    games.close()
+    reloaded = GameStore(games.directory)
+    try:
+        assert states(reloaded, ['a'])['a'] == expected
+    finally:
+        reloaded.close()
+
+
+def test_unknown_games_are_not_created(games):
+    with pytest.raises(GameNotFound):
+        with games.read('nope'):
+            pass
+    with pytest.raises(GameNotFound):
+        games.put('nope', BoardUtils.setup_board(1))
+    assert games.game_ids() == [] and 'nope' not in games.game_locks
+
+
+def test_torn_last_line_is_dropped(games):
+    play(games, 'a', 2, random.Random(2), create=True)
+    games.flush()
+    expected = states(games, ['a'])['a']
+    with open(games.path('a'), 'a') as f:
+        f.write('["1", "roads", [1')  # a crash in the middle of an append
+    _, actions = read_log(games.path('a'))
+    assert state(replay_log(games.path('a'))) == expected
+    with open(games.path('a')) as f:
+        assert f.read().endswith('\n') and len(actions) == games.logged['a']
+
+
+def test_snapshot_of_an_older_log_is_ignored(games):
+    play(games, 'a', 10, random.Random(3), create=True)
+    games.flush()
+    stale = open(games.path('a', 'snap'), 'rb').read()
+    games.put('a', ExampleBoards.example_settlement_cutoff_board())
+    games.flush()
+    expected = states(games, ['a'])['a']
+    with open(games.path('a', 'snap'), 'wb') as f:
+        f.write(stale)
+    assert state(replay_log(games.path('a'), snapshot_path=games.path('a', 'snap'))) == expected
+
+
+def test_a_failed_write_is_saved_again(games, monkeypatch):
+    rng = random.Random(5)
+    play(games, 'a', 2, rng, create=True)
+    games.flush()
+    play(games, 'a', 2, rng)
+    failures = []
+    def failing_open(path, *args, **kwargs):
+        if not failures:
+            failures.append(path)
+            raise OSError(28, 'No space left on device')
+        return open(path, *args, **kwargs)
+    monkeypatch.setattr(store, 'open', failing_open, raising=False)
+    games.flush() # fails, the actions go back to the board
+    assert failures and 'a' in games.dirty
+    play(games, 'a', 1, rng)
+    games.flush()
+    expected = states(games, ['a'])['a']
+    assert 'a' not in games.dirty
+    assert state(replay_log(games.path('a'))) == expected
+
+
+def test_the_writer_keeps_saving_after_a_failed_write(tmp_path, monkeypatch):
+    game_store = GameStore(str(tmp_path), flush_delay=0.01)
+    failures = []
+    def failing_write_atomic(path, data):
+        if not failures:
+            failures.append(path)
+            raise OSError(5, 'Input/output error')
+        write_atomic(path, data)
+    monkeypatch.setattr(store, 'write_atomic', failing_write_atomic)
+    try:
+        play(game_store, 'a', 2, random.Random(6), create=True)
+        for _ in range(200):
+            if os.path.exists(game_store.path('a')) and not game_store.dirty:
+                break
+            time.sleep(0.01)
+        assert failures and game_store.writer.is_alive()
+        expected = states(game_store, ['a'])['a']
+    finally:
+        game_store.close()
+    assert state(replay_log(game_store.path('a'))) == expected
+
+
+class Crash(Exception):
+    pass
+
+
+@pytest.mark.parametrize('change', ['append', 'put'])
+def test_a_crash_at_any_save_step_leaves_a_loadable_game(tmp_path, monkeypatch, change):
+    steps = 0
+    while True:
+        steps += 1
+        directory = str(tmp_path / f'{change}{steps}')
+        game_store = GameStore(directory, flush_delay=3600, flush_every=10**9, snapshot_every=4)
+        rng = random.Random(4)
+        game_store.put('a', ExampleBoards.example_settlement_cutoff_board(), create=True) # a log starting from a snapshot
+        play(game_store, 'a', 3, rng)
+        game_store.flush()
+        old = states(game_store, ['a'])['a']
+        if change == 'put':
+            game_store.put('a', ExampleBoards.example_highest_production_first_spots())
+        play(game_store, 'a', 3, rng)
+        new = states(game_store, ['a'])['a']
+
+        # Fail the steps-th file operation of the save
+        operations = []
+        def failing(operation):
+            def wrapper(path, *args):
+                if operation is not open or args[:1] == ('a',):
+                    operations.append(path)
+                    if len(operations) == steps:
+                        raise Crash()
+                return operation(path, *args)
+            return wrapper
+        with monkeypatch.context() as patch:
+            patch.setattr(store, 'write_atomic', failing(store.write_atomic))
+            patch.setattr(store.os, 'remove', failing(os.remove))
+            patch.setattr(store, 'open', failing(open), raising=False)
+            try:
+                game_store._save(['a'])
+                crashed = False
+            except Crash:
+                crashed = True
+        game_store.closed = True # as if the process died, nothing more is written
+
+        reloaded = GameStore(directory)
+        try:
+            assert states(reloaded, ['a'])['a'] == (new if not crashed or steps > 1 else old)
+        finally:
+            reloaded.close()
+        if not crashed:
+            break
+    assert steps > 2